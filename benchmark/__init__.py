@@ -0,0 +1,6 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: __init__.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/5 : 上午10:02
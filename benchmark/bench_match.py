@@ -0,0 +1,83 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: bench_match.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/5 : 上午10:05
+"""
+MatchHandel 微基准：逐规则 hex 正则查找 与 编译后的前缀树匹配对比
+
+    $ python benchmark/bench_match.py [合成规则数]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import conf
+from core.match import MatchHandel
+
+
+def legacy_match(handel, header, body):
+    """
+    原有实现：每条规则都重新 hex 编码主体并做非锚定查找
+    """
+    if header.get("Content-Length") is None or body is None: return None
+    for rule in handel.rules:
+        for r in rule.getRegex():
+            if isinstance(r, tuple):
+                columns, regex = r
+                if regex.search(header.get(columns) or ""): return rule.getName()
+            elif r.search(body.encode("hex")):
+                return rule.getName()
+    return None
+
+
+def synthetic_rules(num):
+    """
+    生成 num 条随机 8 字节签名，模拟扩充后的签名库
+    """
+    rand = random.Random(num)
+    return [{"name": "FMT%d" % i, "rule": [{"rule": "".join(["%02x" % rand.randint(0, 255) for j in range(8)]),
+                                          "type": "hex"}]} for i in range(num)]
+
+
+def bodies():
+    rand = random.Random(0)
+    noise = "".join([chr(rand.randint(0, 255)) for i in range(1024)])
+    return [
+        "PK\x03\x04" + noise[:1020],
+        "7z\xbc\xaf\x27\x1c\x00\x03" + noise[:1016],
+        "<html><head><title>404 Not Found</title></head><body>" + "x" * 970,
+        noise,
+    ]
+
+
+def bench(func, handel, rounds):
+    header = {"Content-Length": "1024", "Content-Type": "application/octet-stream"}
+    samples = bodies()
+    start = time.time()
+    for i in xrange(rounds):
+        for body in samples:
+            func(handel, header, body)
+    return (time.time() - start) / (rounds * len(samples)) * 1e6
+
+
+def main():
+    extra = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    for num in sorted(set([0, extra or 100, 500])):
+        handel = MatchHandel(conf.get("rules") + synthetic_rules(num))
+        rounds = 200
+        old = bench(legacy_match, handel, rounds)
+        new = bench(lambda h, header, body: h.match(header, body), handel, rounds)
+        for body in bodies():
+            header = {"Content-Length": "1024"}
+            assert legacy_match(handel, header, body) == handel.match(header, body)
+        print "rules=%-4d legacy %9.1f us/body   compiled %7.1f us/body   x%.0f" % (
+            len(handel.rules), old, new, old / new)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: bench_production.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/19 : 下午3:05
+"""
+Production 微基准：path_handle(冷/热)、getSuffix 与字典遍历
+
+    $ python benchmark/bench_production.py [目标数量, 默认 1000]
+
+冷启动清空进程内与磁盘缓存后生成一次字典，热启动为缓存命中后每个目标的耗时，
+ranked 为按内置先验排序(-rank 1)时的耗时
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import conf
+from core import production
+from core.production import Production
+from core.ranking import hit_model
+
+
+def hosts(num):
+    rand = random.Random(num)
+    suffixes = ["com", "net", "org", "com.cn", "co.uk", "gov.cn", "edu", "io"]
+    words = ["www", "mail", "shop", "blog", "api", "dev", "static", "admin"]
+    return ["%s.site%d.%s" % (rand.choice(words), rand.randint(0, 99999), rand.choice(suffixes))
+            for i in xrange(num)]
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    samples = hosts(num)
+    # 磁盘缓存写到临时目录，不影响项目下的 cache
+    root = tempfile.mkdtemp()
+    config = dict(conf, root=root)
+    try:
+        production._static_rules.clear()
+        production._suffix_index.clear()
+        start = time.time()
+        prod = Production(samples[0], config)
+        cold = time.time() - start
+
+        production._static_rules.clear()
+        start = time.time()
+        Production(samples[0], config)
+        disk = time.time() - start
+
+        start = time.time()
+        for host in samples:
+            prod.target = host
+            prod.path_handle()
+        warm = (time.time() - start) / num
+
+        start = time.time()
+        for host in samples:
+            prod.getSuffix(host)
+        suffix = (time.time() - start) / num
+
+        wordlist = prod.getWorkPath()
+        start = time.time()
+        count = sum(1 for path in wordlist)
+        walk = time.time() - start
+
+        hit_model.load(conf.get("prior"))
+        start = time.time()
+        for host in samples:
+            prod.target = host
+            prod.path_handle()
+        ranked = (time.time() - start) / num
+
+        wordlist = prod.getWorkPath()
+        start = time.time()
+        sum(1 for path in wordlist)
+        ranked_walk = time.time() - start
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print "targets=%d paths/target=%d" % (num, count)
+    print "path_handle cold      %9.1f ms" % (cold * 1000)
+    print "path_handle disk      %9.1f ms" % (disk * 1000)
+    print "path_handle warm      %9.1f us/target" % (warm * 1e6)
+    print "getSuffix             %9.2f us/host" % (suffix * 1e6)
+    print "wordlist iteration    %9.2f us/path (%.1f ms)" % (walk * 1e6 / max(1, count), walk * 1000)
+    print "path_handle ranked    %9.1f us/target" % (ranked * 1e6)
+    print "ranked iteration      %9.2f us/path (%.1f ms)" % (ranked_walk * 1e6 / max(1, count), ranked_walk * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: bench_scan.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/19 : 上午11:20
+"""
+端到端基准：对 benchmark/server.py 的各种场景运行完整的 ScanBackup，
+统计吞吐、延迟分位数、每个请求的 CPU 时间及命中情况
+
+    $ python benchmark/bench_scan.py [-scenario plain,soft404] [-engine thread,event] [-shards 8]
+
+服务端在子进程中运行，CPU 时间只包含扫描进程。字典只取 1/shards，
+每个场景的命中路径从这部分字典中按后缀挑选
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import conf
+from core.production import Production
+from core.scanwork import ScanBackup
+from core.ratecontrol import controller
+from core.sink import sink
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+# 场景名: 服务端配置
+SCENARIOS = [
+    ("plain", {}),
+    ("close", {"keepalive": 0}),
+    ("soft404", {"soft404": 1}),
+    ("gzip", {"gzip": 1}),
+    ("slow", {"slow": [0.05, 0.2]}),
+    ("tarpit", {"tarpit": [0.002, 3.0]}),
+    ("reset", {"reset": 0.02}),
+]
+
+HIT_SUFFIX = [(".zip", "zip"), (".rar", "rar"), (".7z", "7z"), (".sql", "sql")]
+
+
+class BenchScan(ScanBackup):
+    """
+    记录每个路径的延迟
+    """
+
+    def __init__(self, target, option, config):
+        self.latencies = []
+        ScanBackup.__init__(self, target, option, config)
+
+    def handle_result(self, path, result, latency=None):
+        if latency is not None: self.latencies.append(latency)
+        ScanBackup.handle_result(self, path, result, latency)
+
+
+def pick_hits(paths):
+    """
+    每种格式取字典中第一个该后缀的路径
+    """
+    hits = {}
+    for path in paths:
+        for suffix, kind in HIT_SUFFIX:
+            if path.endswith(suffix) and kind not in hits.values(): hits[path] = kind
+        if len(hits) == len(HIT_SUFFIX): break
+    return hits
+
+
+def percentile(values, q):
+    if not values: return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(name, behaviour, engine, shards, thread):
+    """
+    运行一个场景
+    :return: 结果行
+    """
+    host = "127.0.0.1"
+    paths = Production(host, conf).getWorkPath().shard(0, shards)
+    behaviour = dict(behaviour, hits=pick_hits(paths))
+    server = subprocess.Popen([sys.executable, SERVER, "-config", json.dumps(behaviour)], stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    target = "%s:%d" % (host, port)
+    root = tempfile.mkdtemp()
+    config = dict(conf, root=root)
+    option = {"thread": thread, "delay": 3.0, "timeout": 3.0, "keepalive": 1, "pipeline": 1, "engine": engine,
+              "concurrency": 1000, "peek": 1024, "probe": "get", "adaptive": 1, "breaker": 10, "shard": (0, shards)}
+    # 限速器按主机共享，各场景独立
+    controller.limiters.clear()
+    controller.max_window, controller.max_delay, controller.timeout = thread, 3.0, 3.0
+    stdout = sys.stdout
+    try:
+        sys.stdout = open(os.devnull, "w")
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        stime = time.time()
+        scan = BenchScan(target, option, config)
+        scan.start()
+        elapsed = time.time() - stime
+        cpu = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = cpu.ru_utime + cpu.ru_stime - usage.ru_utime - usage.ru_stime
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        server.terminate()
+        conns, reqs = server.communicate()[0].split()
+        output_path = os.path.join(root, target.replace(":", "-") + ".txt")
+        found = len(open(output_path).readlines()) if os.path.exists(output_path) else 0
+        shutil.rmtree(root, ignore_errors=True)
+
+    latencies = sorted(scan.latencies)
+    return "%-8s %-6s %6d %7.1f %8.0f %7.1f %7.1f %7.1f %8.3f %6s %5d/%d" % (
+        name, engine, len(latencies), elapsed, len(latencies) / elapsed, percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000,
+        cpu / max(1, int(reqs)) * 1000, conns, found, len(behaviour.get("hits")))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-scenario', action='store', dest='scenario', default=None,
+                        help='comma separated scenarios, default all: ' + ",".join(n for n, b in SCENARIOS))
+    parser.add_argument('-engine', action='store', dest='engine', default="thread,event",
+                        help='comma separated engines: thread,event')
+    parser.add_argument('-shards', action='store', dest='shards', default=8,
+                        help='scan 1/shards of the wordlist')
+    parser.add_argument('-thread', action='store', dest='thread', default=20,
+                        help='per-target concurrency')
+    cmdline = parser.parse_args()
+
+    names = cmdline.scenario.split(",") if cmdline.scenario else [n for n, b in SCENARIOS]
+    # 结果输出不显示逐条进度
+    sink.quiet = True
+    print "%-8s %-6s %6s %7s %8s %7s %7s %7s %8s %6s %7s" % (
+        "scenario", "engine", "paths", "secs", "req/s", "p50 ms", "p95 ms", "p99 ms", "cpu ms", "conns", "hits")
+    for name, behaviour in SCENARIOS:
+        if name not in names: continue
+        for engine in cmdline.engine.split(","):
+            print run(name, behaviour, engine, int(cmdline.shards), int(cmdline.thread))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: server.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/19 : 上午10:10
+"""
+基准测试用的本地 HTTP/1.1 服务，行为由 JSON 配置决定
+
+    $ python benchmark/server.py -port 18080 -config '{"soft404": 1, "gzip": 1}'
+
+配置项：
+    hits      {路径: zip/rar/7z/sql} 命中的备份文件
+    soft404   不存在的路径返回 200 及回显路径的页面
+    gzip      客户端接受时错误页面以 gzip 压缩
+    keepalive 0 时每个响应后关闭连接
+    slow      [比例, 秒] 延迟响应
+    tarpit    [比例, 秒] 在该时间内逐字节发送响应头
+    reset     比例，不响应直接以 RST 关闭连接
+
+比例按路径哈希决定，同一配置多次运行的行为相同。启动后在标准输出打印实际端口，
+退出(SIGTERM)时打印 "连接数 请求数"
+"""
+import sys
+import json
+import gzip
+import time
+import zlib
+import socket
+import signal
+import struct
+import random
+import urllib
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from StringIO import StringIO
+
+# 各格式的文件头，与 resource/finger.json 中的签名对应
+MAGIC = {
+    "zip": "PK\x03\x04\x14\x00\x00\x00\x08\x00",
+    "rar": "Rar!\x1a\x07\x00\xcf\x90\x73\x00\x00\x0d\x00",
+    "7z": "7z\xbc\xaf\x27\x1c\x00\x03",
+}
+
+NOT_FOUND = "<html><head><title>404 Not Found</title></head><body><h1>Not Found</h1>" \
+            "<p>The requested URL %s was not found on this server.</p><hr><address>Apache Server</address>" \
+            "</body></html>"
+
+SOFT_404 = "<!DOCTYPE html><html><head><title>Welcome</title></head><body><div id=\"nav\">%s</div>" \
+           "<div class=\"content\"><p>Sorry, the page <b>%s</b> could not be found.</p>" \
+           "<p>Request id %s, served in %d ms.</p></div></body></html>"
+
+
+def roll(kind, path):
+    """
+    按路径哈希得到 [0, 1) 的值
+    """
+    return random.Random(kind + path).random()
+
+
+def compress(data):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count(conns=1)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        self.respond(True)
+
+    def respond(self, with_body):
+        config = self.server.config
+        self.server.count(reqs=1)
+        path = urllib.unquote(self.path.split("?")[0]).lstrip("/")
+
+        if roll("reset", path) < config.get("reset", 0):
+            # SO_LINGER 为 0 时 close 发送 RST
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = 1
+            self.connection.close()
+            return
+        ratio, seconds = config.get("slow") or (0, 0)
+        if roll("slow", path) < ratio: time.sleep(seconds)
+
+        status, headers, body = self.content(path)
+        if not config.get("keepalive", 1): headers.append(("Connection", "close"))
+        headers.append(("Content-Length", str(len(body))))
+        head = "HTTP/1.1 %d %s\r\n" % (status, self.responses[status][0]) + \
+               "".join(["%s: %s\r\n" % h for h in headers]) + "\r\n"
+
+        ratio, seconds = config.get("tarpit") or (0, 0)
+        if roll("tarpit", path) < ratio:
+            # 每次只发送一个字节，单次读取超时不会触发
+            interval = seconds / max(1, len(head))
+            for c in head:
+                self.wfile.write(c)
+                self.wfile.flush()
+                time.sleep(interval)
+            head = ""
+        # 响应头与主体一次写出，避免 Nagle 与延迟确认叠加的 40ms 等待
+        self.wfile.write(head + body if with_body else head)
+        if not config.get("keepalive", 1): self.close_connection = 1
+
+    def content(self, path):
+        """
+        :return: status, [(name, value), ...], body
+        """
+        config = self.server.config
+        kind = config.get("hits", {}).get(path)
+        if kind == "sql":
+            body = "-- MySQL dump 10.13  Distrib 5.7.22\n--\n-- Host: localhost    Database: site\n" + \
+                   "INSERT INTO `users` VALUES (1,'admin','%s');\n" % ("0" * 32) * 64
+            return 200, [("Content-type", "application/x-sql")], body
+        if kind is not None:
+            body = MAGIC[kind] + "".join(chr(i % 251) for i in xrange(8192))
+            return 200, [("Content-Type", "application/octet-stream")], body
+
+        if config.get("soft404"):
+            status, body = 200, SOFT_404 % ("&nbsp;" * 200, path, "%08x" % random.getrandbits(32),
+                                             random.randint(1, 50))
+        else:
+            status, body = 404, NOT_FOUND % ("/" + path)
+        headers = [("Content-Type", "text/html; charset=utf-8"), ("Server", "Apache"),
+                   ("Date", self.date_time_string())]
+        accept = self.headers.get("Accept-Encoding") or ""
+        if config.get("gzip") and "gzip" in accept:
+            body = compress(body)
+            headers.append(("Content-Encoding", "gzip"))
+        elif config.get("gzip") and "deflate" in accept:
+            body = zlib.compress(body)
+            headers.append(("Content-Encoding", "deflate"))
+        return status, headers, body
+
+
+class BenchServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, config):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.config = config
+        self.conns = 0
+        self.reqs = 0
+        self.lock = threading.Lock()
+
+    def count(self, conns=0, reqs=0):
+        with self.lock:
+            self.conns += conns
+            self.reqs += reqs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-port', action='store', dest='port', default=0,
+                        help='listen port, 0 picks a free one')
+    parser.add_argument('-config', action='store', dest='config', default="{}",
+                        help='behaviour as json')
+    cmdline = parser.parse_args()
+
+    server = BenchServer(("127.0.0.1", int(cmdline.port)), json.loads(cmdline.config))
+
+    def stop(signum, frame):
+        raise SystemExit
+
+    signal.signal(signal.SIGTERM, stop)
+    print server.server_address[1]
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except (SystemExit, KeyboardInterrupt):
+        pass
+    print server.conns, server.reqs
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
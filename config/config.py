@@ -22,6 +22,7 @@ def load_config(path):
 
 
 conf = {"root": BASE_DIR, "rules": load_config("resource/finger.json"), "match": load_config("resource/work_rule.json"),
-        "suffix": load_config("resource/file_suffix.json"), "host_suffix": load_config("resource/host_suffix.json")}
+        "suffix": load_config("resource/file_suffix.json"), "host_suffix": load_config("resource/host_suffix.json"),
+        "prior": load_config("resource/hit_prior.json")}
 # rules = load_config("resource/finger.json")
 # rules = load_config("resource/finger.json")
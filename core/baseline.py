@@ -0,0 +1,185 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: baseline.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/6 : 下午3:40
+import re
+import math
+import random
+import string
+import hashlib
+
+# 每次请求都会变化、不参与比较的响应头
+VOLATILE_HEADERS = ("date", "expires", "set-cookie", "etag", "last-modified", "content-length", "age",
+                    "content-range", "keep-alive", "connection", "x-request-id", "x-runtime", "cf-ray")
+
+_NONCE = re.compile(r"[0-9a-fA-F]{8,}|\d+")
+_WORD = re.compile(r"\w+")
+
+
+def simhash(tokens):
+    """
+    64 位 simhash
+    :param tokens: 特征列表
+    :return:
+    """
+    weights = [0] * 64
+    for token in tokens:
+        h = int(hashlib.md5(token).hexdigest()[:16], 16)
+        for i in xrange(64):
+            weights[i] += 1 if h >> i & 1 else -1
+    return sum(1 << i for i in xrange(64) if weights[i] > 0)
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def length_bucket(length):
+    """
+    长度分桶，桶宽约为长度的 10%
+    """
+    return int(math.log(length + 1, 1.1))
+
+
+class Fingerprint(object):
+    """
+    响应的模糊指纹
+    """
+
+    def __init__(self, result, path=""):
+        status, body, headers = result
+        self.status = status
+        # 错误页常回显请求路径，比较前去掉路径及数字、随机串
+        name = path.split("/")[-1]
+        # 字典路径为 unicode，直接替换二进制主体会因隐式解码失败
+        if isinstance(name, unicode): name = name.encode("utf-8")
+        if name: body = body.replace(name, "")
+        self.text = _NONCE.sub("0", body)
+        self.length = length_bucket(len(self.text))
+        self.digest = hashlib.md5(self.text).digest()
+        self.header_lines = frozenset(["%s:%s" % (k.lower(), _NONCE.sub("0", v)) for k, v in headers.items()
+                                       if k.lower() not in VOLATILE_HEADERS])
+        self._body_hash = None
+
+    def compact(self):
+        """
+        预先计算 simhash 并释放主体文本，用于长期缓存的基线
+        """
+        self.body_hash()
+        self.text = None
+        return self
+
+    def body_hash(self):
+        if self._body_hash is None:
+            words = _WORD.findall(self.text)
+            self._body_hash = simhash([" ".join(words[i:i + 3]) for i in xrange(max(1, len(words) - 2))])
+        return self._body_hash
+
+    def similar(self, other):
+        """
+        比较两个指纹：主体按长度桶与 simhash 距离，响应头按归一化后的 Jaccard 相似度
+        归一化后完全相同时不计算 simhash
+        :return: (_status, _body, _headers)
+        """
+        _status = self.status == other.status
+        _body = self.digest == other.digest or (
+            _status and abs(self.length - other.length) <= 1 and distance(self.body_hash(), other.body_hash()) <= 3)
+        union = len(self.header_lines | other.header_lines)
+        _headers = not union or len(self.header_lines & other.header_lines) >= 0.6 * union
+        return _status, _body, _headers
+
+
+class Calibrator(object):
+    """
+    多基线错误页面校准：每个文件后缀、每个目录前缀各取一个不存在路径的响应作为基线
+    """
+
+    def __init__(self, scan, config):
+        self.scan = scan
+        self.suffix = sorted(set(config.get("suffix")), key=len, reverse=True)
+        self.dirs = []
+        for r in config.get("match").get("adding"):
+            prefix = r.get("adding").split("|")[0]
+            if prefix.endswith("/") and prefix not in self.dirs: self.dirs.append(prefix)
+        self.baselines = {}
+        # 默认基线的原始响应
+        self.default = None
+        self.count = 0
+
+    def token(self):
+        return "".join(random.choice(string.ascii_lowercase + string.digits) for i in range(12))
+
+    def probes(self):
+        """
+        校准路径
+        :return: [(key, path), ...]
+        """
+        probes = [("", "get_404_page"), ("", self.token())]
+        for suffix in self.suffix:
+            probes.append((suffix, self.token() + suffix))
+        for prefix in self.dirs:
+            probes.append((prefix, prefix + self.token() + ".zip"))
+        return probes
+
+    def calibrate(self):
+        """
+        获取基线，断点续扫时使用日志中保存的基线
+        :return: 默认基线的原始响应
+        """
+        journal = self.scan.journal
+        stored = journal.load_baseline(self.scan.target) if journal and self.scan.option.get("resume") else None
+        if stored:
+            probes = [(k, path) for k, path, status, body, headers in stored]
+            results = [(status, body.decode("base64"), headers) for k, path, status, body, headers in stored]
+        else:
+            probes = self.probes()
+            self.count = len(probes)
+            results = self.fetch([path for k, path in probes])
+            if journal:
+                journal.save_baseline(self.scan.target, [[k, path, status, body.encode("base64"), headers] for
+                                                         (k, path), (status, body, headers) in zip(probes, results)])
+        for (k, path), result in zip(probes, results):
+            self.baselines.setdefault(k, []).append(Fingerprint(result, path).compact())
+        self.default = results[0]
+        return self.default
+
+    def fetch(self, paths):
+        """
+        按 -pipeline 深度分批请求校准路径，深度为 1 时逐个请求
+        """
+        depth = int(self.scan.option.get("pipeline") or 1) if self.scan.pool is not None else 1
+        results = []
+        for i in xrange(0, len(paths), depth):
+            results.extend(self.scan.fetch(paths[i:i + depth]))
+        return results
+
+    def keys(self, path):
+        """
+        路径对应的基线
+        """
+        keys = [""]
+        for suffix in self.suffix:
+            if path.endswith(suffix):
+                keys.append(suffix)
+                break
+        for prefix in self.dirs:
+            if path.startswith(prefix):
+                keys.append(prefix)
+                break
+        return keys
+
+    def match(self, result, path):
+        """
+        与路径相关的基线比较，与任一基线相似即为错误页面
+        :return: (_status, _body, _headers)
+        """
+        fingerprint = Fingerprint(result, path)
+        best = (False, False, False)
+        for key in self.keys(path):
+            for baseline in self.baselines.get(key, []):
+                similar = fingerprint.similar(baseline)
+                if all(similar): return similar
+                if sum(similar) > sum(best): best = similar
+        return best
@@ -14,14 +14,17 @@ class Rule(object):
 
     name = None
     regex = None
+    source = None
 
     def __init__(self, rule):
         name = rule.get("name")
         rule = rule.get("rule")
         regex = []
+        source = []
         for i in rule:
             _rule = i.get("rule")
             _type = i.get("type")
+            source.append((_type, _rule.replace(" ", "") if _type in ["hex", "str"] else _rule))
 
             if _type in ["hex", "str"]:
                 _rule = re.compile(_rule.replace(" ", ""))
@@ -32,6 +35,7 @@ class Rule(object):
 
         self.name = name
         self.regex = regex
+        self.source = source
 
     def getRegex(self):
         """
@@ -40,6 +44,13 @@ class Rule(object):
         """
         return self.regex
 
+    def getSource(self):
+        """
+        获取规则原文
+        :return: [(type, rule), ...]
+        """
+        return self.source
+
     def getName(self):
         """
         获取规则名称
@@ -0,0 +1,315 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: cluster.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/20 : 下午4:30
+import os
+import json
+import time
+import socket
+import threading
+import itertools
+import SocketServer
+from collections import deque
+
+from AnsiColor import Print, Print_B, Print_W, Print_E
+from scanwork import ScanBackup
+from sink import sink, _HIT
+from metrics import metrics
+from targets import normalize
+
+# 协议：每行一个 JSON 数组，["hello", 名称]、["lease"]、["complete", 批次] 有一行 JSON 对象应答，
+# ["sink", 结果]、["metrics", 名称, 指标] 无应答。节点的任何消息都会续约其持有的批次
+
+
+def parse_address(address):
+    """
+    "host:port" 解析
+    :return: (host, port)
+    """
+    host, port = address.rsplit(":", 1)
+    return host or "0.0.0.0", int(port)
+
+
+class Batch(object):
+    """
+    一批目标
+    """
+
+    def __init__(self, batch_id, targets):
+        self.id = batch_id
+        self.targets = targets
+        self.attempts = 0
+        self.owner = None
+        self.deadline = 0.0
+
+
+class Coordinator(object):
+    """
+    目标批次分配：工作节点租用批次，节点断开或租约到期未续约时批次重新分配，
+    同一批次失败 retries 次后放弃。批次在租用时才从目标流中读取
+    """
+
+    def __init__(self, targets, batch=10, lease=120, retries=3):
+        self.lease_time = lease
+        self.retries = retries
+        self.source = iter(targets)
+        self.batch = batch
+        self.exhausted = False
+        self.batches = 0
+        self.total = 0
+        self.pending = deque()
+        self.leased = {}
+        self.done = set()
+        self.failed = []
+        self.names = {}
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        batch = self._read()
+        if batch is not None: self.pending.append(batch)
+        self._check()
+
+    def _read(self):
+        """
+        从目标流读取下一批次
+        :return: Batch 或 None
+        """
+        if self.exhausted: return None
+        targets = list(itertools.islice(self.source, self.batch))
+        if not targets:
+            self.exhausted = True
+            return None
+        batch = Batch(self.batches, targets)
+        self.batches += 1
+        self.total += len(targets)
+        return batch
+
+    def hello(self, owner, name):
+        with self.lock:
+            self.names[owner] = name
+        Print("工作节点 <%s> 已连接" % name)
+
+    def lease(self, owner):
+        """
+        租用一个批次
+        :return: {"batch": , "targets": , "lease": } 或 {"wait": 秒} 或 {"done": True}
+        """
+        with self.lock:
+            self._expire()
+            batch = self.pending.popleft() if self.pending else self._read()
+            if batch is not None:
+                batch.attempts += 1
+                batch.owner = owner
+                batch.deadline = time.time() + self.lease_time
+                self.leased[batch.id] = batch
+                Print("批次 <%d> %d 个目标 -> %s" % (batch.id, len(batch.targets), self.names.get(owner)))
+                return {"batch": batch.id, "targets": batch.targets, "lease": self.lease_time}
+            if self.leased:
+                # 其他节点的批次仍可能失败重试
+                return {"wait": 1.0}
+            self._check()
+            return {"done": True}
+
+    def renew(self, owner):
+        """
+        续约节点持有的全部批次
+        """
+        with self.lock:
+            deadline = time.time() + self.lease_time
+            for batch in self.leased.values():
+                if batch.owner is owner: batch.deadline = deadline
+
+    def complete(self, owner, batch_id):
+        with self.lock:
+            batch = self.leased.pop(batch_id, None)
+            if batch is None:
+                # 租约已过期的批次由原节点完成，不再重复扫描
+                batch = ([b for b in self.pending if b.id == batch_id] or [None])[0]
+                if batch is not None: self.pending.remove(batch)
+            if batch_id not in self.done:
+                self.done.add(batch_id)
+                Print_B("批次 <%d> 完成 (%s)" % (batch_id, self.names.get(owner)))
+            self._check()
+        return {"ok": True}
+
+    def release(self, owner):
+        """
+        节点断开，未完成的批次重新分配
+        """
+        with self.lock:
+            name = self.names.pop(owner, None)
+            metrics.retire(name)
+            for batch in [b for b in self.leased.values() if b.owner is owner]:
+                del self.leased[batch.id]
+                Print_W("工作节点 <%s> 断开，批次 <%d> 重新分配" % (name, batch.id))
+                self._requeue(batch)
+            self._check()
+
+    def expire(self):
+        with self.lock:
+            self._expire()
+            self._check()
+
+    def _expire(self):
+        now = time.time()
+        for batch in [b for b in self.leased.values() if b.deadline < now]:
+            del self.leased[batch.id]
+            Print_W("批次 <%d> 租约到期，重新分配" % batch.id)
+            self._requeue(batch)
+
+    def _requeue(self, batch):
+        if batch.attempts >= self.retries:
+            self.failed.append(batch)
+            Print_E("批次 <%d> 失败 %d 次，放弃: %s" % (
+                batch.id, batch.attempts, ", ".join(t.get("target") for t in batch.targets)))
+        else:
+            batch.owner = None
+            self.pending.appendleft(batch)
+
+    def _check(self):
+        if self.exhausted and not self.pending and not self.leased: self.finished.set()
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """
+    一个工作节点连接
+    """
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line: break
+                message = json.loads(line)
+                coordinator.renew(self)
+                op = message[0]
+                reply = None
+                if op == "hello":
+                    coordinator.hello(self, message[1].encode("utf-8"))
+                    reply = {"ok": True}
+                elif op == "lease":
+                    reply = coordinator.lease(self)
+                elif op == "complete":
+                    reply = coordinator.complete(self, message[1])
+                elif op == "sink":
+                    item = message[1]
+                    if item[0] == _HIT:
+                        # 结果写到本节点的目录，目标来自网络，规范化后才用于文件名
+                        record = item[2]
+                        target = normalize(record.get("target").encode("utf-8"))
+                        if target is None: raise ValueError("invalid target %r" % record.get("target"))
+                        sink.hit(ScanBackup.result_path(self.server.root, target), record, item[3])
+                elif op == "metrics":
+                    metrics.merge(message[1], message[2])
+                if reply is not None:
+                    self.wfile.write(json.dumps(reply) + "\n")
+                    self.wfile.flush()
+        except socket.error:
+            pass
+        except (ValueError, IndexError, AttributeError), e:
+            Print_W("工作节点 %s 消息无效，断开: %s" % (self.client_address[0], e))
+        finally:
+            coordinator.release(self)
+
+
+class CoordinatorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coordinator, root):
+        SocketServer.TCPServer.__init__(self, address, _Handler)
+        self.coordinator = coordinator
+        self.root = root
+
+
+def run_coordinator(option, config):
+    """
+    协调节点：按批次分发目标，汇总各节点的发现与指标，全部批次完成后退出
+    """
+    coordinator = Coordinator(option.get("targets"), option.get("batch"), option.get("lease"))
+    server = CoordinatorServer(parse_address(option.get("serve")), coordinator, config.get("root"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    host, port = server.server_address
+    Print("协调节点 %s:%d，每批 %d 个目标" % (host, port, coordinator.batch))
+    try:
+        while not coordinator.finished.wait(1):
+            coordinator.expire()
+        # 等待空闲节点取得结束应答后断开
+        deadline = time.time() + 5
+        while coordinator.names and time.time() < deadline:
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        Print_W("中断，停止分发")
+    server.shutdown()
+    Print_B("**** %d 个目标，完成 %d 个批次，失败 %d 个批次" % (
+        coordinator.total, len(coordinator.done), len(coordinator.failed)))
+
+
+class CoordinatorClient(object):
+    """
+    工作节点到协调节点的连接，put 供结果输出与指标转发使用
+    """
+
+    def __init__(self, address, timeout=30):
+        self.sock = socket.create_connection(parse_address(address), timeout)
+        self.sock.settimeout(None)
+        self.rfile = self.sock.makefile("rb")
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        with self.lock:
+            self.sock.sendall(json.dumps(message) + "\n")
+
+    def call(self, *message):
+        """
+        发送请求并等待应答，只在一个线程中调用
+        """
+        self.put(message)
+        line = self.rfile.readline()
+        if not line: raise socket.error("coordinator closed the connection")
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+
+def run_worker(option, scan):
+    """
+    工作节点：从协调节点租用批次扫描，发现与指标发往协调节点
+    :param scan: 扫描目标列表的函数 scan(option)，返回 True 时停止租用
+    """
+    name = "%s-%d" % (socket.gethostname(), os.getpid())
+    try:
+        client = CoordinatorClient(option.get("join"))
+        client.call("hello", name)
+    except socket.error, e:
+        Print_E("无法连接协调节点 %s: %s" % (option.get("join"), e))
+        return
+    # 逐条进度只在本地无意义地占用带宽，协调节点按指标显示进度
+    sink.forward(client, progress=False)
+    metrics.forward(client, name)
+    try:
+        while True:
+            reply = client.call("lease")
+            if reply.get("done"): break
+            if "wait" in reply:
+                time.sleep(reply.get("wait"))
+                continue
+            targets = [{"id": t.get("id"), "target": t.get("target").encode("utf-8")} for t in reply.get("targets")]
+            if scan(dict(option, targets=targets)):
+                # 选择了结束任务：不报告完成，断开后协调节点将本批次重新分配
+                Print_W("结束任务，退出工作节点，批次 <%d> 交还协调节点" % reply.get("batch"))
+                break
+            client.call("complete", reply.get("batch"))
+    except socket.error, e:
+        Print_E("与协调节点的连接中断: %s" % e)
+    finally:
+        metrics.stop()
+        client.close()
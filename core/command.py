@@ -4,11 +4,22 @@
 # Description: command.py python2.7
 # License: Apache Licence 
 # CreateTime: 2018/6/27 : 下午5:18
+import re
 import sys
-import random
 import argparse
 
 from AnsiColor import ansi
+from targets import iter_targets, open_targets
+
+
+def parse_size(size):
+    """
+    字节数，支持 K/M/G 后缀
+    """
+    size = str(size).strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if size and size[-1] in units: return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
 
 
 def command():
@@ -18,52 +29,118 @@ def command():
 
     parser = argparse.ArgumentParser()
     VER_INT = "1.0.0"
-    parser.add_argument('-t', action='store', dest='target', help='target: "/target.txt,192.168.1.1,www.site.com"')
-    parser.add_argument('-d', action='store', dest='delay', default=3, help='speed')
+    parser.add_argument('-t', action='store', dest='target',
+                        help='target: "/target.txt", "-" for stdin, or "192.168.1.1,www.site.com"')
+    parser.add_argument('-d', action='store', dest='delay', default=3,
+                        help='max per-host backoff delay in seconds when a host throttles or fails')
+    parser.add_argument('-adaptive', action='store', dest='adaptive', default=1,
+                        help='adapt per-host concurrency, delay and timeouts to latency and errors: 1/0')
     parser.add_argument('-thread', action='store', dest='thread', default=10, help='scan thread num')
-    parser.add_argument('-timeout', action='store', dest='timeout', default=3, help='http timeout')
+    parser.add_argument('-timeout', action='store', dest='timeout', default=3,
+                        help='max http timeout, adaptive mode derives per-host timeouts from round-trip times')
+    parser.add_argument('-keepalive', action='store', dest='keepalive', default=1, help='keep-alive connection pool: 1/0')
+    parser.add_argument('-pipeline', action='store', dest='pipeline', default=1, help='http pipelining depth')
+    parser.add_argument('-engine', action='store', dest='engine', default='thread', choices=['thread', 'event'],
+                        help='scan engine: thread/event')
+    parser.add_argument('-concurrency', action='store', dest='concurrency', default=1000,
+                        help='event engine in-flight connections')
+    parser.add_argument('-active', action='store', dest='active', default=10, help='targets scanned at once')
+    parser.add_argument('-hostcap', action='store', dest='hostcap', default=0,
+                        help='max in-flight requests per host, default thread num, half of it in the shared thread pool')
+    parser.add_argument('-probe', action='store', dest='probe', default='get', choices=['get', 'range', 'head'],
+                        help='probe mode: get/range/head, range only downloads the file header')
+    parser.add_argument('-peek', action='store', dest='peek', default=1024, help='body bytes read per response')
+    parser.add_argument('-rank', action='store', dest='rank', default=1,
+                        help='probe likely paths first, learned from resource/hit_prior.json and past findings: 1/0')
+    parser.add_argument('-dnsttl', action='store', dest='dnsttl', default=300, help='dns cache ttl')
+    parser.add_argument('-breaker', action='store', dest='breaker', default=10,
+                        help='pause a target after this many consecutive failures, abort after 3 pauses, 0 disables')
+    parser.add_argument('-maxreq', action='store', dest='maxreq', default=0,
+                        help='stop a target after this many requests, 0 is unlimited')
+    parser.add_argument('-maxtime', action='store', dest='maxtime', default=0,
+                        help='stop a target after scanning it for this many seconds, 0 is unlimited')
+    parser.add_argument('-maxbytes', action='store', dest='maxbytes', default=0,
+                        help='stop a target after receiving this many bytes, K/M/G suffixes allowed, 0 is unlimited')
+    parser.add_argument('-maxhits', action='store', dest='maxhits', default=0,
+                        help='stop a target after this many findings, 0 is unlimited')
+    parser.add_argument('-shard', action='store', dest='shard', default=None,
+                        help='scan only part of the wordlist: "index/total", e.g. 0/4')
+    parser.add_argument('-journal', action='store', dest='journal', default=None,
+                        help='progress journal file (sqlite), required for -resume')
+    parser.add_argument('-resume', action='store_true', dest='resume', default=False,
+                        help='skip targets and paths finished in the journal')
+    parser.add_argument('-output', action='store', dest='output', default=None,
+                        help='structured results file, csv when it ends with .csv, otherwise jsonl')
+    parser.add_argument('-quiet', action='store_true', dest='quiet', default=False,
+                        help='show a periodic summary instead of every response')
+    parser.add_argument('-procs', action='store', dest='procs', default=1,
+                        help='worker processes, targets are split across them by host')
+    parser.add_argument('-serve', action='store', dest='serve', default=None,
+                        help='run as coordinator on "host:port", handing target batches to workers')
+    parser.add_argument('-join', action='store', dest='join', default=None,
+                        help='run as worker of the coordinator at "host:port", -t is not needed')
+    parser.add_argument('-batch', action='store', dest='batch', default=10,
+                        help='targets per batch handed to a worker')
+    parser.add_argument('-chunk', action='store', dest='chunk', default=1000,
+                        help='targets read, resolved and checked at a time with -active 1 or -procs')
+    parser.add_argument('-lease', action='store', dest='lease', default=120,
+                        help='seconds a worker may go silent before its batch is handed out again')
+    parser.add_argument('-metrics', action='store', dest='metrics', default=None,
+                        help='write metrics to a prometheus textfile, e.g. backupscan.prom')
+    parser.add_argument('-stats', action='store', dest='stats', default=10,
+                        help='seconds between metrics summary lines, 0 disables')
     parser.add_argument('-version', action='version', version='%(prog)s ' + VER_INT)
 
     cmdline = parser.parse_args()
 
-    if not cmdline.target:
+    if not cmdline.target and not cmdline.join:
         parser.print_help()
         exit()
 
-    # 单目标
-    target = cmdline.target
-    target = target[7:] if target.startswith("http://") else target
-    target = target[8:] if target.startswith("https://") else target
-    targets = []
+    for address in (cmdline.serve, cmdline.join):
+        if address and not re.match(r"^[\w.\-]*:\d+$", address):
+            print ansi.error("地址格式错误: '%s'\n" % address)
+            sys.exit()
 
-    # 文件
-    if target.find('.txt') > -1 and target.find('://') == -1:
+    # 文件、标准输入或逗号相隔，逐行读取，规范化并去重；工作节点的目标由协调节点分配
+    targets = iter([])
+    if cmdline.target:
         try:
-            with open(target) as filex:
-                for url in filex.readlines():
-                    url = url[7:] if url.startswith("http://") else url
-                    url = url[8:] if url.startswith("https://") else url
-                    targets.append({"id": random.randrange(1111, 9999, 4), "target": url.replace('\n', '')})
+            targets = iter_targets(open_targets(cmdline.target))
         except IOError as error_info:
-            print ansi.error("文件无法打开: '%s'\n" % target)
+            print ansi.error("文件无法打开: '%s'\n" % cmdline.target)
             print parser.print_help()
             sys.exit()
 
-    # 逗号相隔
-    elif target.find(',') != -1:
-        targetL = target.split(",")
-        for url in targetL:
-            targets.append({"id": random.randrange(1111, 9999, 4), "target": url})
-    elif len(target) >= 5:
-        targets.append({"id": random.randrange(1111, 9999, 4), "target": target})
-    else:
-        print parser.print_help()
+    shard = None
+    if cmdline.shard:
+        try:
+            shard = tuple(int(i) for i in cmdline.shard.split("/"))
+            assert len(shard) == 2 and 0 <= shard[0] < shard[1]
+        except (ValueError, AssertionError):
+            print ansi.error("分片格式错误: '%s'\n" % cmdline.shard)
+            sys.exit()
+
+    try:
+        maxbytes = parse_size(cmdline.maxbytes)
+    except ValueError:
+        print ansi.error("字节数格式错误: '%s'\n" % cmdline.maxbytes)
         sys.exit()
 
-    delay = cmdline.delay
-    thread_num = cmdline.thread
-    timeout = int(cmdline.timeout)
+    delay = float(cmdline.delay)
+    thread_num = int(cmdline.thread)
+    timeout = float(cmdline.timeout)
 
-    option = {"thread": thread_num, "delay": delay, "timeout": timeout, "targets": targets}
+    option = {"thread": thread_num, "delay": delay, "timeout": timeout, "targets": targets,
+              "keepalive": int(cmdline.keepalive), "pipeline": int(cmdline.pipeline), "engine": cmdline.engine,
+              "concurrency": int(cmdline.concurrency), "active": int(cmdline.active), "hostcap": int(cmdline.hostcap),
+              "probe": cmdline.probe, "peek": int(cmdline.peek), "rank": int(cmdline.rank),
+              "dnsttl": int(cmdline.dnsttl), "shard": shard,
+              "journal": cmdline.journal, "resume": cmdline.resume, "adaptive": int(cmdline.adaptive),
+              "breaker": int(cmdline.breaker), "maxreq": int(cmdline.maxreq), "maxtime": float(cmdline.maxtime),
+              "maxbytes": maxbytes, "maxhits": int(cmdline.maxhits), "output": cmdline.output, "quiet": cmdline.quiet,
+              "metrics": cmdline.metrics, "stats": float(cmdline.stats),
+              "procs": int(cmdline.procs), "serve": cmdline.serve, "join": cmdline.join,
+              "batch": max(1, int(cmdline.batch)), "lease": float(cmdline.lease), "chunk": max(1, int(cmdline.chunk))}
 
     return option
@@ -0,0 +1,443 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: connpool.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/2 : 上午10:12
+import time
+import zlib
+import socket
+import threading
+
+from resolver import resolver
+from metrics import metrics
+
+# 各线程读取的字节数，线程池中按目标统计流量
+_local = threading.local()
+
+_https = False
+try:
+    import ssl
+
+    _https = True
+except ImportError:
+    print "import ssl error"
+    pass
+
+# 单个响应头最大长度
+MAX_HEADER = 16384
+# 为复用连接而丢弃剩余主体的上限
+DRAIN_LIMIT = 65536
+# chunked 主体
+CHUNKED = -1
+# chunked 解析状态
+_CHUNK_SIZE, _CHUNK_DATA, _CHUNK_END, _CHUNK_TRAILER = range(4)
+
+
+def thread_received():
+    """
+    当前线程累计读取的字节数
+    """
+    return getattr(_local, "received", 0)
+
+
+def open_socket(host, port, timeout=3):
+    """
+    建立 TCP/SSL 连接
+    :param host:
+    :param port:
+    :param timeout:
+    :return: socket 或 None
+    """
+    ip = resolver.resolve(host)
+    if ip is None: return None
+    socketObj = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if int(port) == 443:
+            if not _https:
+                raise Exception("Not support SSL")
+            try:
+                socketObj = ssl.wrap_socket(socketObj, ssl_version=ssl.PROTOCOL_TLSv1)
+            except ssl.SSLError:
+                socketObj = ssl.wrap_socket(socketObj, ssl_version=ssl.PROTOCOL_SSLv23)
+
+        socketObj.settimeout(timeout)
+        socketObj.connect((ip, int(port)))
+        return socketObj
+    except IOError:
+        socketObj.close()
+        return None
+
+
+def parse_header(header):
+    """
+    解析响应头
+    :param header: 不含结尾空行的响应头
+    :return: status, headers
+    """
+    version, status, reason, headers = "", "", "", {}
+    header_lines = header.split("\r\n")
+    line = header_lines[0]
+    try:
+        [version, status, reason] = line.split(None, 2)
+    except ValueError:
+        try:
+            # 无原因短语的状态行，如 "HTTP/1.1 429 "
+            [version, status] = line.split(None, 1)
+            status = status.strip()
+        except ValueError:
+            version = ""
+    for line in header_lines[1:]:
+        if len(line) == 0:
+            continue
+        colonIndex = line.find(":")
+        fieldName = line[:colonIndex]
+        fieldValue = line[colonIndex + 1:].strip()
+        headers[fieldName] = fieldValue
+    return version, status, headers
+
+
+def header_get(headers, name):
+    """
+    不区分大小写获取响应头
+    """
+    name = name.lower()
+    for key in headers:
+        if key.lower() == name:
+            return headers[key]
+    return None
+
+
+def response_length(version, status, headers, method="GET"):
+    """
+    计算响应主体长度及连接能否复用
+    :return: (主体长度, chunked 为 CHUNKED, 无长度时为 None), reusable
+    """
+    connection = (header_get(headers, "Connection") or "").lower()
+    reusable = connection != "close" and (version != "HTTP/1.0" or connection == "keep-alive")
+    if method == "HEAD" or status in ("204", "304") or status.startswith("1"):
+        return 0, reusable
+    if "chunked" in (header_get(headers, "Transfer-Encoding") or "").lower():
+        return CHUNKED, reusable
+    length = header_get(headers, "Content-Length")
+    if length is not None and length.isdigit():
+        return int(length), reusable
+    # 无长度的响应以连接关闭结束，只读取所需部分，连接不再复用
+    return None, False
+
+
+def decode_body(body, encoding, limit):
+    """
+    以 decompressobj 增量解压主体前缀，截断的压缩流只返回已解出的部分
+    :param body: 主体(可能不完整)
+    :param encoding: Content-Encoding
+    :param limit: 最多输出的字节数，防止压缩炸弹
+    :return: 解压后的主体，无法解压时为 None
+    """
+    encoding = (encoding or "").lower()
+    if "gzip" in encoding:
+        wbits = (16 + zlib.MAX_WBITS,)
+    elif "deflate" in encoding:
+        # 部分服务端发送不带 zlib 头的原始 deflate 流
+        wbits = (zlib.MAX_WBITS, -zlib.MAX_WBITS)
+    else:
+        return body
+    for bits in wbits:
+        try:
+            return zlib.decompressobj(bits).decompress(body, limit)
+        except zlib.error:
+            pass
+    return None
+
+
+class ResponseReader(object):
+    """
+    增量响应解析：数据以 recv_into 读入预分配的 bytearray，响应头只解析一次，
+    主体支持 Content-Length、chunked 与无长度三种形式，只保留前 peek 字节，
+    可复用的连接上丢弃剩余主体，超过 DRAIN_LIMIT 则停止读取
+    """
+
+    def __init__(self, peek, size=16384):
+        self.peek = peek
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.reset()
+
+    def reset(self):
+        self.head = None
+        self.length = None
+        self.body = bytearray()
+        self.total = 0
+        self.chunk = 0
+        self.state = _CHUNK_SIZE
+
+    def pending(self):
+        """
+        缓冲区中未解析的字节数
+        """
+        return self.end - self.start
+
+    def recv_from(self, sock):
+        """
+        从 socket 读入缓冲区
+        :return: 读取的字节数，0 表示连接关闭
+        """
+        if self.end == len(self.buf): self._compact()
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        metrics.received += n
+        _local.received = getattr(_local, "received", 0) + n
+        return n
+
+    def _compact(self):
+        size = self.end - self.start
+        if self.start:
+            self.buf[:size] = self.buf[self.start:self.end]
+            self.start, self.end = 0, size
+        if self.end == len(self.buf):
+            # 存在 memoryview 时 bytearray 无法扩容
+            self.view = None
+            self.buf.extend(bytearray(len(self.buf)))
+            self.view = memoryview(self.buf)
+
+    def _consume(self, n):
+        self.start += n
+        if self.start == self.end: self.start = self.end = 0
+
+    def _keep(self, n):
+        """
+        取出 n 字节主体，超出 peek 的部分丢弃
+        """
+        room = self.peek - len(self.body)
+        if room > 0: self.body += self.view[self.start:self.start + min(n, room)]
+        self.total += n
+        self._consume(n)
+
+    def _finish(self, reusable):
+        status, headers = self.head[:2]
+        body = str(self.body)
+        self.reset()
+        return status, body, headers, reusable
+
+    def parse(self, method="GET", eof=False):
+        """
+        尝试从缓冲区解析一个完整响应
+        :param method: 请求方法
+        :param eof: 连接是否已关闭
+        :return: None 表示数据不足，否则为 status, body, headers, reusable
+        """
+        if self.head is None:
+            index = self.buf.find("\r\n\r\n", self.start, self.end)
+            if index < 0:
+                if self.pending() > MAX_HEADER: return "", "", {}, False
+                return None
+            version, status, headers = parse_header(str(self.buf[self.start:index]))
+            self._consume(index + 4 - self.start)
+            self.length, reusable = response_length(version, status, headers, method)
+            self.head = (status, headers, reusable)
+        reusable = self.head[2]
+        length = self.length
+
+        if length is None:
+            self._keep(self.pending())
+            if len(self.body) < self.peek and not eof: return None
+            return self._finish(False)
+
+        if length == CHUNKED:
+            done = self._chunks()
+            if done is None:
+                if self.total > DRAIN_LIMIT and len(self.body) >= self.peek: return self._finish(False)
+                if not eof: return None
+                return self._finish(False)
+            return self._finish(reusable and done)
+
+        self._keep(min(self.pending(), length - self.total))
+        if self.total >= length: return self._finish(reusable)
+        if length > DRAIN_LIMIT and len(self.body) >= self.peek: return self._finish(False)
+        if not eof: return None
+        return self._finish(False)
+
+    def _chunks(self):
+        """
+        解析 chunked 主体
+        :return: None 表示数据不足，True 为主体结束，False 为格式错误
+        """
+        while True:
+            if self.state == _CHUNK_DATA:
+                n = min(self.pending(), self.chunk)
+                self._keep(n)
+                self.chunk -= n
+                if self.chunk: return None
+                self.state = _CHUNK_END
+            if self.pending() < 2: return None
+            index = self.buf.find("\r\n", self.start, self.end)
+            if index < 0: return False if self.pending() > 1024 else None
+            line = str(self.buf[self.start:index])
+            self._consume(index + 2 - self.start)
+            if self.state == _CHUNK_END:
+                if line: return False
+                self.state = _CHUNK_SIZE
+            elif self.state == _CHUNK_SIZE:
+                try:
+                    self.chunk = int(line.split(";")[0].strip(), 16)
+                except ValueError:
+                    return False
+                self.state = _CHUNK_DATA if self.chunk else _CHUNK_TRAILER
+            elif not line:
+                return True
+
+
+class HttpConnection(object):
+    """
+    可复用的 HTTP 连接
+    """
+
+    def __init__(self, host, port, timeout=3, rtt=None):
+        """
+        :param timeout: 固定超时，rtt 为空时使用
+        :param rtt: HostRtt，按主机往返时间计算连接与读取超时并记录样本
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.rtt = rtt
+        stime = time.time()
+        self.sock = open_socket(host, port, rtt.connect.timeout() if rtt else timeout)
+        if rtt is not None:
+            if self.sock is not None:
+                rtt.connect.sample(time.time() - stime)
+            elif time.time() - stime >= rtt.connect.timeout():
+                rtt.connect.backoff()
+        self.requests = 0
+        self.reader = ResponseReader(0)
+        self.closed = self.sock is None
+        if self.closed: metrics.error("connect")
+
+    def send(self, data):
+        """
+        发送请求，可一次发送多个(管线化)
+        :param data:
+        """
+        self.sock.sendall(data)
+
+    def read_response(self, peek, method="GET"):
+        """
+        读取一个响应，主体只保留前 peek 字节
+        :param peek: 主体读取长度
+        :param method: 请求方法
+        :return: status, body, headers, reusable
+        """
+        reader = self.reader
+        reader.peek = peek
+        if self.rtt is not None: self.sock.settimeout(self.rtt.read.timeout())
+        # 管线化时后续响应可能已在缓冲区中，不作为往返时间样本
+        stime = time.time() if not reader.pending() else None
+        while True:
+            response = reader.parse(method)
+            if response is not None: break
+            try:
+                n = reader.recv_from(self.sock)
+            except socket.timeout:
+                metrics.error("timeout")
+                if self.rtt is not None: self.rtt.read.backoff()
+                raise
+            except socket.error:
+                metrics.error("reset")
+                raise
+            if stime is not None and self.rtt is not None: self.rtt.read.sample(time.time() - stime)
+            stime = None
+            if not n:
+                response = reader.parse(method, eof=True)
+                if response is None:
+                    metrics.error("closed")
+                    raise socket.error("connection closed")
+                break
+        self.requests += 1
+        return response
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.closed = True
+
+
+class ConnectionPool(object):
+    """
+    按 host:port 维护的持久连接池
+    """
+
+    def __init__(self, max_requests=1000):
+        self.max_requests = max_requests
+        self.idle = {}
+        self.handshakes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, host, port, timeout=3, rtt=None):
+        """
+        获取空闲连接，没有则新建
+        :return: (HttpConnection, 是否为复用连接)
+        """
+        key = (host, str(port))
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+            self.handshakes += 1
+        return HttpConnection(host, port, timeout, rtt), False
+
+    def release(self, conn, reusable=True):
+        """
+        归还连接，不可复用或达到请求上限则关闭
+        """
+        if conn.closed: return
+        if not reusable or conn.requests >= self.max_requests or conn.reader.pending():
+            conn.close()
+            return
+        key = (conn.host, str(conn.port))
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def fetch(self, host, port, timeout, requests, peek, rtt=None):
+        """
+        在一个连接上(管线化)发送多个请求，连接中途关闭则剩余请求换连接重试
+        :param requests: [(method, raw_request), ...]
+        :param peek: 主体读取长度
+        :param rtt: HostRtt，为空时使用固定超时
+        :return: [(status, body, headers), ...] 失败的请求为 None
+        """
+        results = []
+        while len(results) < len(requests):
+            pending = requests[len(results):]
+            conn, reused = self.acquire(host, port, timeout, rtt)
+            if conn.closed:
+                break
+            done = len(results)
+            reusable = False
+            try:
+                conn.send("".join([raw for method, raw in pending]))
+                for method, raw in pending:
+                    status, body, headers, reusable = conn.read_response(peek, method)
+                    results.append((status, body, headers))
+                    if not reusable: break
+            except (socket.error, socket.timeout):
+                reusable = False
+            self.release(conn, reusable)
+            # 复用的空闲连接可能已被服务端关闭，换连接重试；新连接无进展则放弃
+            if len(results) == done and not reused:
+                break
+        return results + [None] * (len(requests) - len(results))
+
+    def close(self):
+        """
+        关闭所有空闲连接
+        """
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
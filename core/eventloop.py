@@ -0,0 +1,426 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: eventloop.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/3 : 下午2:36
+import time
+import errno
+import select
+import socket
+import resource
+from collections import deque
+
+from AnsiColor import Print_W
+from connpool import ResponseReader
+from resolver import resolver
+from ratecontrol import classify, OK, ERROR
+from metrics import metrics
+
+_https = False
+try:
+    import ssl
+
+    _https = True
+except ImportError:
+    pass
+
+_READ, _WRITE = 1, 4
+
+# 连接状态，IDLE 为等待主机限速放行
+CONNECTING, HANDSHAKE, SENDING, READING, IDLE = range(5)
+
+
+class Poller(object):
+    """
+    epoll 不可用时退回 select
+    """
+
+    def __init__(self):
+        self.epoll = select.epoll() if hasattr(select, "epoll") else None
+        self.fds = {}
+
+    def register(self, fd, events):
+        if fd in self.fds:
+            if self.fds[fd] == events: return
+            if self.epoll: self.epoll.modify(fd, events)
+        elif self.epoll:
+            self.epoll.register(fd, events)
+        self.fds[fd] = events
+
+    def unregister(self, fd):
+        if fd not in self.fds: return
+        del self.fds[fd]
+        if self.epoll: self.epoll.unregister(fd)
+
+    def poll(self, timeout):
+        if self.epoll:
+            return [(fd, (_READ if e & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR) else 0) |
+                     (_WRITE if e & select.EPOLLOUT else 0)) for fd, e in self.epoll.poll(timeout)]
+        rlist = [fd for fd, e in self.fds.items() if e & _READ]
+        wlist = [fd for fd, e in self.fds.items() if e & _WRITE]
+        if not rlist and not wlist:
+            time.sleep(timeout)
+            return []
+        r, w, x = select.select(rlist, wlist, [], timeout)
+        events = dict((fd, _READ) for fd in r)
+        for fd in w: events[fd] = events.get(fd, 0) | _WRITE
+        return events.items()
+
+
+class Connection(object):
+    """
+    事件循环中的一个连接，按顺序承载多个请求
+    """
+
+    def __init__(self, task, peek):
+        self.task = task
+        self.sock = None
+        self.state = CONNECTING
+        self.out = ""
+        self.outstanding = deque()
+        self.reader = ResponseReader(peek)
+        self.responses = 0
+        self.deadline = 0
+        # 连接发起或本批请求发送完成的时间
+        self.sent = 0
+        self.waiting = False
+        # 当前批次占用的限速名额
+        self.acquired = False
+        self.started = 0
+        self.received = 0
+        self.outcome = OK
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class ScanTask(object):
+    """
+    事件引擎中的单个扫描目标
+    """
+
+    def __init__(self, scan):
+        self.scan = scan
+        self.paths = scan.iter_paths()
+        self.retry = deque()
+        self.conns = 0
+        self.exhausted = False
+
+    def take(self, num):
+        """
+        取出至多 num 个待请求路径，重试路径优先，目标达到预算上限后放弃剩余路径
+        :return: [(path, 已尝试次数), ...]
+        """
+        if self.scan.over_budget(): self.skip()
+        paths = []
+        while self.retry and len(paths) < num:
+            paths.append(self.retry.popleft())
+        while not self.exhausted and len(paths) < num:
+            try:
+                paths.append((self.paths.next(), 0))
+            except StopIteration:
+                self.exhausted = True
+        return paths
+
+    def skip(self):
+        """
+        放弃剩余路径
+        """
+        self.paths = iter([])
+        self.retry.clear()
+        self.exhausted = True
+
+    def done(self):
+        return (self.exhausted and not self.retry) or self.scan.status or self.scan.breaker.aborted
+
+
+class EventEngine(object):
+    """
+    基于 epoll/select 的单线程扫描引擎，以非阻塞连接替代线程池
+    """
+
+    def __init__(self, concurrency, per_target, depth=1):
+        self.concurrency = concurrency
+        self._raise_nofile(concurrency)
+        self.per_target = per_target
+        self.depth = max(1, depth)
+        self.poller = Poller()
+        self.tasks = []
+        self.conns = {}
+        self.parked = []
+
+    def add(self, scan):
+        """
+        加入扫描目标
+        :param scan: ScanBackup
+        """
+        self.tasks.append(ScanTask(scan))
+
+    def run(self, feed=None, finished=None):
+        """
+        运行直到所有目标扫描结束，可被 KeyboardInterrupt 中断后再次调用
+        :param feed: 每轮调用，可在其中 add 新目标，返回是否仍有目标待加入
+        :param finished: 目标结束回调，参数为 ScanBackup
+        """
+        while True:
+            more = feed() if feed else False
+            for task in [t for t in self.tasks if not t.conns and t.done()]:
+                self.tasks.remove(task)
+                if finished: finished(task.scan)
+            self._wake()
+            self._fill()
+            if not self.conns and not self.tasks and not more:
+                break
+            for fd, event in self.poller.poll(0.05 if self.parked else 0.2):
+                conn = self.conns.get(fd)
+                if conn is None: continue
+                try:
+                    if conn.state in (CONNECTING, HANDSHAKE, SENDING) and event & _WRITE:
+                        self._on_write(conn)
+                    elif conn.state == HANDSHAKE and event & _READ:
+                        self._handshake(conn)
+                    elif conn.state == READING and event & _READ:
+                        self._on_read(conn)
+                    elif event & _READ:
+                        self._close(conn, failed="closed")
+                except (socket.error, IOError):
+                    self._close(conn, failed="reset")
+            now = time.time()
+            for conn in [c for c in self.conns.values() if c.deadline < now]:
+                rtt = conn.task.scan.rtt
+                if rtt is not None:
+                    (rtt.connect if conn.state in (CONNECTING, HANDSHAKE) else rtt.read).backoff()
+                self._close(conn, failed="timeout")
+
+    @staticmethod
+    def _raise_nofile(concurrency):
+        """
+        文件描述符软上限提高到足够 concurrency 个连接，不超过硬上限
+        """
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            want = concurrency + 64
+            if hard != resource.RLIM_INFINITY: want = min(want, hard)
+            if soft != resource.RLIM_INFINITY and soft < want:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+        except (ValueError, resource.error):
+            pass
+
+    def _fill(self):
+        for task in self.tasks:
+            limiter = task.scan.limiter
+            cap = min(self.per_target, limiter.limit()) if limiter else self.per_target
+            for i in xrange(min(cap - task.conns, self.concurrency - len(self.conns))):
+                if task.done() or not self._open(task): break
+            if len(self.conns) >= self.concurrency: break
+
+    def _wake(self):
+        """
+        限速放行后恢复等待中的连接
+        """
+        parked, self.parked = self.parked, []
+        for conn in parked:
+            conn.state = SENDING
+            self._next(conn)
+
+    def _acquire(self, conn):
+        """
+        为连接的下一批请求占用主机限速名额并取出路径
+        :return: 路径列表，熔断或限速未放行、无路径时为空
+        """
+        task = conn.task
+        limiter = task.scan.limiter
+        if limiter and not limiter.acquire(block=False): return []
+        if not task.scan.breaker.allow():
+            if limiter: limiter.cancel()
+            return []
+        paths = task.take(self.depth)
+        if not paths:
+            if limiter: limiter.cancel()
+            return []
+        conn.acquired = limiter is not None
+        conn.started, conn.received, conn.outcome = time.time(), 0, OK
+        return paths
+
+    def _release(self, conn, outcome):
+        if not conn.acquired: return
+        conn.acquired = False
+        latency = (time.time() - conn.started) / max(1, conn.received)
+        conn.task.scan.limiter.release(outcome, latency)
+
+    def _open(self, task):
+        """
+        新建连接并预先分配首批路径，连接失败时这些路径按失败处理
+        :return: 是否新建了连接
+        """
+        scan = task.scan
+        conn = Connection(task, scan.peek)
+        paths = self._acquire(conn)
+        if not paths: return False
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+        except socket.error, e:
+            # 文件描述符耗尽：路径退回重试队列，归还限速名额，并发上限降到当前连接数
+            task.retry.extendleft(reversed(paths))
+            if conn.acquired: scan.limiter.cancel()
+            if e.errno in (errno.EMFILE, errno.ENFILE) and len(self.conns) < self.concurrency:
+                self.concurrency = max(1, len(self.conns))
+                Print_W("文件描述符不足，并发连接数降为 %d" % self.concurrency)
+            return False
+        conn.outstanding.extend(paths)
+        metrics.add_inflight(len(paths))
+        conn.sock = sock
+        task.conns += 1
+        self.conns[sock.fileno()] = conn
+        conn.sent = time.time()
+        conn.deadline = conn.sent + scan.connect_timeout()
+        ip = resolver.resolve(scan.host)
+        try:
+            err = sock.connect_ex((ip, int(scan.port))) if ip else errno.EHOSTUNREACH
+        except socket.error, e:
+            err = e.errno or errno.EHOSTUNREACH
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self._close(conn, failed="connect")
+            return True
+        self.poller.register(sock.fileno(), _WRITE)
+        return True
+
+    def _on_write(self, conn):
+        if conn.state == CONNECTING:
+            err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._close(conn, failed="connect")
+                return
+            scan = conn.task.scan
+            if scan.rtt is not None: scan.rtt.connect.sample(time.time() - conn.sent)
+            conn.deadline = time.time() + scan.connect_timeout()
+            if int(conn.task.scan.port) == 443 and _https:
+                fd = conn.sock.fileno()
+                conn.sock = ssl.wrap_socket(conn.sock, do_handshake_on_connect=False)
+                self.conns[fd] = conn
+                conn.state = HANDSHAKE
+                self._handshake(conn)
+            else:
+                self._next(conn)
+            return
+        if conn.state == HANDSHAKE:
+            self._handshake(conn)
+            return
+        sent = conn.sock.send(conn.out)
+        conn.out = conn.out[sent:]
+        if not conn.out:
+            conn.state = READING
+            conn.sent, conn.waiting = time.time(), True
+            conn.deadline = conn.sent + conn.task.scan.read_timeout()
+            self.poller.register(conn.fileno(), _READ)
+
+    def _handshake(self, conn):
+        try:
+            conn.sock.do_handshake()
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self.poller.register(conn.fileno(), _READ)
+            elif e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self.poller.register(conn.fileno(), _WRITE)
+            else:
+                self._close(conn, failed="connect")
+            return
+        self._next(conn)
+
+    def _next(self, conn):
+        """
+        连接空闲时发送下一批请求，无任务则关闭，限速未放行时等待
+        """
+        task = conn.task
+        if not conn.outstanding:
+            if task.done():
+                self._close(conn)
+                return
+            paths = self._acquire(conn)
+            if not paths:
+                if task.done():
+                    self._close(conn)
+                else:
+                    conn.state = IDLE
+                    conn.deadline = float("inf")
+                    self.poller.register(conn.fileno(), _READ)
+                    self.parked.append(conn)
+                return
+            conn.outstanding.extend(paths)
+            metrics.add_inflight(len(paths))
+        conn.out = "".join([task.scan.build_request(path) for path, tries in conn.outstanding])
+        conn.state = SENDING
+        conn.deadline = time.time() + task.scan.read_timeout()
+        self.poller.register(conn.fileno(), _WRITE)
+
+    def _on_read(self, conn):
+        budget = conn.task.scan.budget
+        try:
+            n = conn.reader.recv_from(conn.sock)
+            budget.charge(received=n)
+            eof = not n
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ: return
+            raise
+        if hasattr(conn.sock, "pending"):
+            while conn.sock.pending():
+                budget.charge(received=conn.reader.recv_from(conn.sock))
+        conn.deadline = time.time() + conn.task.scan.read_timeout()
+        while conn.outstanding:
+            response = conn.reader.parse(eof=eof)
+            if response is None: break
+            path, tries = conn.outstanding.popleft()
+            metrics.add_inflight(-1)
+            conn.responses += 1
+            if conn.waiting:
+                # 每批只以首个响应作为往返时间样本
+                conn.waiting = False
+                if conn.task.scan.rtt is not None: conn.task.scan.rtt.read.sample(time.time() - conn.sent)
+            if conn.acquired:
+                conn.received += 1
+                latency = (time.time() - conn.started) / conn.received
+                conn.outcome = max(conn.outcome, classify(response[:3], latency,
+                                                          conn.task.scan.limiter.base_latency))
+            self._deliver(conn.task, path, response[:3], time.time() - conn.sent)
+            if not response[3]:
+                self._close(conn)
+                return
+        if eof:
+            self._close(conn, failed=False if conn.responses else "closed")
+        elif not conn.outstanding:
+            self._release(conn, conn.outcome)
+            self._next(conn)
+
+    def _deliver(self, task, path, response, latency=None):
+        scan = task.scan
+        if response is not None and latency is not None: metrics.latency(latency)
+        scan.record_response(response)
+        scan.handle_result(path, scan.decode(response), latency)
+
+    def _close(self, conn, failed=False):
+        """
+        关闭连接，未完成的请求在已有响应的连接上重试一次，否则按失败处理
+        :param failed: 失败类型 connect/timeout/reset/closed，正常关闭为 False
+        """
+        fd = conn.fileno()
+        if self.conns.pop(fd, None) is None: return
+        if failed and conn.outstanding: metrics.error(failed)
+        metrics.add_inflight(-len(conn.outstanding))
+        self.poller.unregister(fd)
+        if conn.state == IDLE: self.parked.remove(conn)
+        self._release(conn, ERROR if failed else conn.outcome)
+        try:
+            conn.sock.close()
+        except socket.error:
+            pass
+        task = conn.task
+        task.conns -= 1
+        while conn.outstanding:
+            path, tries = conn.outstanding.popleft()
+            # 正常关闭或复用连接失效时重试一次，新连接失败则按失败处理
+            if tries == 0 and (not failed or conn.responses):
+                task.retry.append((path, tries + 1))
+            else:
+                self._deliver(task, path, None)
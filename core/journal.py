@@ -0,0 +1,115 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: journal.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/12 : 下午2:05
+import time
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (target TEXT PRIMARY KEY, finished REAL);
+CREATE TABLE IF NOT EXISTS paths (target TEXT, path TEXT, PRIMARY KEY (target, path));
+CREATE TABLE IF NOT EXISTS findings (target TEXT, url TEXT, status TEXT, length TEXT, type TEXT, created REAL);
+CREATE TABLE IF NOT EXISTS baselines (target TEXT PRIMARY KEY, data TEXT);
+"""
+
+
+class Journal(object):
+    """
+    扫描进度日志(SQLite)，记录已完成的路径、发现与基线，写入按批提交
+    """
+
+    def __init__(self, path, batch=1000, interval=2.0):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.pending = []
+        self.last_flush = time.time()
+
+    def _execute(self, sql, args):
+        with self.lock:
+            self.pending.append((sql, args))
+            if len(self.pending) >= self.batch or time.time() - self.last_flush >= self.interval:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            with self.db:
+                for sql, args in self.pending:
+                    self.db.execute(sql, args)
+            self.pending = []
+        self.last_flush = time.time()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def record(self, target, path):
+        """
+        记录已完成的路径
+        """
+        self._execute("INSERT OR IGNORE INTO paths VALUES (?, ?)", (target, path))
+
+    def finding(self, target, url, status, length, type_name):
+        """
+        记录发现
+        """
+        self._execute("INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?)",
+                      (target, url, status, str(length), type_name, time.time()))
+
+    def finish_target(self, target):
+        """
+        标记目标扫描完成，其路径记录不再需要
+        """
+        self._execute("INSERT OR REPLACE INTO targets VALUES (?, ?)", (target, time.time()))
+        self._execute("DELETE FROM paths WHERE target = ?", (target,))
+
+    def target_done(self, target):
+        with self.lock:
+            self._flush()
+            return self.db.execute("SELECT 1 FROM targets WHERE target = ?", (target,)).fetchone() is not None
+
+    def done_paths(self, target):
+        """
+        目标已完成的路径
+        :return: set
+        """
+        with self.lock:
+            self._flush()
+            return set(row[0] for row in self.db.execute("SELECT path FROM paths WHERE target = ?", (target,)))
+
+    def save_baseline(self, target, data):
+        """
+        保存错误页面基线
+        :param data: 可 JSON 序列化的基线数据
+        """
+        self._execute("INSERT OR REPLACE INTO baselines VALUES (?, ?)", (target, json.dumps(data)))
+
+    def load_baseline(self, target):
+        with self.lock:
+            self._flush()
+            row = self.db.execute("SELECT data FROM baselines WHERE target = ?", (target,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def findings(self):
+        """
+        全部发现
+        :return: [(target, url, status, length, type), ...]
+        """
+        with self.lock:
+            self._flush()
+            return self.db.execute("SELECT target, url, status, length, type FROM findings").fetchall()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
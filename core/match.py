@@ -2,12 +2,69 @@
 # -*- coding:utf-8 -*-
 # Author: ver007
 # Description: match.py python2.7
-# License: Apache Licence 
+# License: Apache Licence
 # CreateTime: 2018/6/26 : 下午3:51
 import re
+import binascii
 
 from bean.rule import Rule
 
+_HEX = "0123456789abcdefABCDEF"
+_QUANTIFIER = "*+?{"
+
+
+def split_hex_prefix(pattern):
+    """
+    拆分 hex 规则的字面前缀与剩余正则
+    :param pattern: hex 规则，如 1f8b0800*0003ec
+    :return: (前缀字节, 剩余正则原文)
+    """
+    end = 0
+    while end < len(pattern) and pattern[end] in _HEX:
+        end += 1
+    # 前缀最后一个字符后接量词时不属于字面前缀
+    if end < len(pattern) and pattern[end] in _QUANTIFIER:
+        end -= 1
+    end -= end % 2
+    return binascii.unhexlify(pattern[:end]), pattern[end:]
+
+
+class SignatureTrie(object):
+    """
+    hex 规则字面前缀组成的字节前缀树，从主体首字节开始一次遍历得到所有候选规则
+    """
+
+    def __init__(self):
+        self.root = ({}, [])
+        self.depth = 0
+
+    def add(self, prefix, index, tail):
+        """
+        加入规则
+        :param prefix: 字面前缀字节
+        :param index: 规则序号
+        :param tail: 前缀之后需继续匹配的正则，None 表示前缀即完整规则
+        """
+        node = self.root
+        for char in prefix:
+            node = node[0].setdefault(char, ({}, []))
+        node[1].append((index, tail, len(prefix) * 2))
+        self.depth = max(self.depth, len(prefix))
+
+    def walk(self, body):
+        """
+        沿主体字节遍历前缀树
+        :param body: 响应主体
+        :return: [(规则序号, 剩余正则, 剩余正则在 hex 串中的起点), ...]
+        """
+        node = self.root
+        found = list(node[1])
+        for char in body[:self.depth]:
+            node = node[0].get(char)
+            if node is None: break
+            found.extend(node[1])
+        return found
+
 
 class MatchHandel(object):
     """
@@ -20,6 +77,27 @@ class MatchHandel(object):
         self.rules = []
         for rule_str in rules:
             self.rules.append(Rule(rule_str))
+        self.compile()
+
+    def compile(self):
+        """
+        将全部规则编译为一棵字节前缀树，无字面前缀的 hex 规则、str 规则和 header 规则单独保存
+        """
+        self.trie = SignatureTrie()
+        self.others = []
+        for index, rule in enumerate(self.rules):
+            for _type, source in rule.getSource():
+                if _type == "hex":
+                    prefix, tail = split_hex_prefix(source)
+                    if prefix:
+                        self.trie.add(prefix, index, re.compile(tail) if tail else None)
+                    else:
+                        self.others.append((index, "hex", re.compile(tail)))
+                elif _type == "str":
+                    self.others.append((index, "str", re.compile(source)))
+                elif _type == "header":
+                    [columns, r] = source.split("|")
+                    self.others.append((index, "header", (columns, re.compile(r))))
 
     def match(self, header, body):
         """
@@ -29,26 +107,22 @@ class MatchHandel(object):
         :return:
         """
         if header.get("Content-Length") is None or body is None: return None
-        for rule in self.rules:
-            if self._march(rule, header, body):
-                return rule.getName()
-        return None
-
-    def _march(self, rule, header, body):
-        """
-        匹配实现
-        :param rule: 用于匹配的规则
-        :param header: HTTP 头类型
-        :param body: HTTP 主体内容
-        :return:
-        """
-        try:
-            for r in rule.getRegex():
-                if isinstance(r, tuple):
-                    columns, regex = r
-                    if regex.search(header.get(columns) or ""): return True
-                else:
-                    if r.search(body.encode("hex")): return True
-        except Exception, e:
-            pass
-        return False
+        best, hex_body = len(self.rules), None
+        for index, tail, offset in self.trie.walk(body):
+            if index >= best: continue
+            if tail is not None:
+                if hex_body is None: hex_body = binascii.hexlify(body)
+                if not tail.match(hex_body, offset): continue
+            best = index
+        for index, _type, regex in self.others:
+            if index >= best: break
+            if _type == "header":
+                columns, column_regex = regex
+                if column_regex.search(header.get(columns) or ""):
+                    best = index
+            else:
+                if hex_body is None: hex_body = binascii.hexlify(body)
+                # hex 规则从首字节锚定，str 规则保持原有的全文查找
+                if (regex.match(hex_body) if _type == "hex" else regex.search(hex_body)):
+                    best = index
+        return self.rules[best].getName() if best < len(self.rules) else None
@@ -0,0 +1,258 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: metrics.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/18 : 下午3:20
+import os
+import time
+import bisect
+import threading
+
+from AnsiColor import Print_B
+
+# 延迟直方图桶上界(秒)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics(object):
+    """
+    扫描指标：请求数、进行中的请求、延迟直方图、接收字节、状态码与错误分类、各目标进度，
+    定期输出汇总行并写入 Prometheus textfile
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.inflight = 0
+        # 接收字节在读取热路径上无锁累加，允许少量误差
+        self.received = 0
+        self.codes = {}
+        self.errors = {}
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.targets = {}
+        self.finished = 0
+        # 子进程上报的指标 {进程: snapshot}
+        self.children = {}
+        self.thread = None
+        self.stopped = threading.Event()
+        self.last = (time.time(), 0)
+
+    def start(self, path=None, interval=10):
+        """
+        启动指标输出线程
+        :param path: Prometheus textfile 路径
+        :param interval: 输出间隔，0 时不输出汇总行
+        """
+        self.path = path
+        self.interval = interval
+        if not path and not interval: return
+        self.last = (time.time(), self.requests)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval or 10):
+            self.report()
+
+    def forward(self, queue, key, interval=1.0):
+        """
+        定期将指标(含本进程汇总的子进程指标)发送给父进程或协调节点
+        :param queue: multiprocessing.Queue
+        :param key: 进程标识
+        """
+        # fork 继承的计数、锁与线程状态重新初始化，只上报本进程的指标
+        self.__init__()
+        self.path, self.interval = None, 0
+
+        def send():
+            while not self.stopped.wait(interval):
+                queue.put(("metrics", key, self.totals()))
+            queue.put(("metrics", key, self.totals()))
+
+        self.thread = threading.Thread(target=send)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def report(self):
+        if self.interval: Print_B(self.summary())
+        if self.path: self.write(self.path)
+
+    def stop(self):
+        """
+        结束输出线程，写出最终指标
+        """
+        if self.thread is None: return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        if self.path: self.write(self.path)
+
+    def snapshot(self):
+        """
+        当前指标，可跨进程传递
+        """
+        with self.lock:
+            return {"requests": self.requests, "inflight": self.inflight, "received": self.received,
+                    "codes": dict(self.codes), "errors": dict(self.errors), "buckets": list(self.buckets),
+                    "latency_sum": self.latency_sum, "latency_count": self.latency_count,
+                    "targets": dict((k, list(v)) for k, v in self.targets.items()), "finished": self.finished}
+
+    def merge(self, key, snapshot):
+        """
+        记录子进程上报的指标，汇总时与本进程相加
+        """
+        with self.lock:
+            self.children[key] = snapshot
+
+    def retire(self, key):
+        """
+        子进程或工作节点退出，保留其计数，清除进行中的请求与目标
+        """
+        with self.lock:
+            child = self.children.get(key)
+            if child is not None:
+                child["inflight"] = 0
+                child["targets"] = {}
+
+    def totals(self):
+        """
+        本进程与全部子进程的指标之和
+        """
+        total = self.snapshot()
+        with self.lock:
+            children = self.children.values()
+        for child in children:
+            for name in ("requests", "inflight", "received", "latency_sum", "latency_count", "finished"):
+                total[name] += child[name]
+            for name in ("codes", "errors"):
+                for k, v in child[name].items():
+                    total[name][k] = total[name].get(k, 0) + v
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], child["buckets"])]
+            total["targets"].update(child["targets"])
+        return total
+
+    def add_inflight(self, num):
+        with self.lock:
+            self.inflight += num
+
+    def error(self, kind):
+        """
+        请求失败
+        :param kind: connect/timeout/reset
+        """
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def latency(self, seconds):
+        with self.lock:
+            self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.latency_sum += seconds
+            self.latency_count += 1
+
+    def result(self, target, status):
+        """
+        处理完一个路径
+        :param status: 状态码，失败为空
+        """
+        with self.lock:
+            self.requests += 1
+            code = status or "none"
+            self.codes[code] = self.codes.get(code, 0) + 1
+            progress = self.targets.get(target)
+            if progress is not None: progress[0] += 1
+
+    def target_start(self, target, total):
+        with self.lock:
+            self.targets[target] = [0, total]
+
+    def target_end(self, target):
+        with self.lock:
+            if self.targets.pop(target, None) is not None: self.finished += 1
+
+    def quantile(self, q, totals=None):
+        """
+        由直方图估计延迟分位数，取所在桶的上界
+        """
+        totals = totals or self.totals()
+        total, buckets = totals["latency_count"], totals["buckets"]
+        if not total: return None
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), buckets):
+            seen += count
+            if seen >= q * total: return bound
+        return float("inf")
+
+    def summary(self):
+        """
+        汇总行
+        """
+        totals = self.totals()
+        now, requests = time.time(), totals["requests"]
+        rate = (requests - self.last[1]) / max(0.001, now - self.last[0])
+        self.last = (now, requests)
+        p50, p95 = self.quantile(0.5, totals), self.quantile(0.95, totals)
+        latency = "p50 <%.0fms p95 <%.0fms" % (p50 * 1000, p95 * 1000) if p50 is not None else "p50 - p95 -"
+        targets = totals["targets"].values()
+        return "%.0f req/s  inflight %d  %s  recv %.1fMB  errors %d  active targets %d (%d/%d paths)  finished %d" % (
+            rate, totals["inflight"], latency, totals["received"] / 1048576.0, sum(totals["errors"].values()),
+            len(targets), sum(p[0] for p in targets), sum(p[1] for p in targets), totals["finished"])
+
+    def prometheus(self):
+        """
+        Prometheus 文本格式
+        """
+        t = self.totals()
+        lines = [
+            "# HELP backupscan_requests_total Paths handled.",
+            "# TYPE backupscan_requests_total counter",
+            "backupscan_requests_total %d" % t["requests"],
+            "# HELP backupscan_inflight Requests waiting for a response.",
+            "# TYPE backupscan_inflight gauge",
+            "backupscan_inflight %d" % t["inflight"],
+            "# HELP backupscan_received_bytes_total Bytes received from targets.",
+            "# TYPE backupscan_received_bytes_total counter",
+            "backupscan_received_bytes_total %d" % t["received"],
+            "# HELP backupscan_responses_total Responses by status code, none for failed requests.",
+            "# TYPE backupscan_responses_total counter",
+        ]
+        lines += ['backupscan_responses_total{code="%s"} %d' % (code, count)
+                  for code, count in sorted(t["codes"].items())]
+        lines += ["# HELP backupscan_errors_total Failed requests by class.",
+                  "# TYPE backupscan_errors_total counter"]
+        lines += ['backupscan_errors_total{kind="%s"} %d' % (kind, count)
+                  for kind, count in sorted(t["errors"].items())]
+        lines += ["# HELP backupscan_latency_seconds Time to first response.",
+                  "# TYPE backupscan_latency_seconds histogram"]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), t["buckets"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append('backupscan_latency_seconds_bucket{le="%s"} %d' % (le, cumulative))
+        lines.append("backupscan_latency_seconds_sum %f" % t["latency_sum"])
+        lines.append("backupscan_latency_seconds_count %d" % t["latency_count"])
+        lines += ["# HELP backupscan_target_paths Paths of each active target.",
+                  "# TYPE backupscan_target_paths gauge"]
+        for target, (done, total) in sorted(t["targets"].items()):
+            name = target.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append('backupscan_target_paths{target="%s",state="done"} %d' % (name, done))
+            lines.append('backupscan_target_paths{target="%s",state="total"} %d' % (name, total))
+        lines += ["# HELP backupscan_targets_finished_total Targets finished.",
+                  "# TYPE backupscan_targets_finished_total counter",
+                  "backupscan_targets_finished_total %d" % t["finished"]]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        原子写入 textfile，避免采集到写了一半的文件
+        """
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+        os.rename(tmp, path)
+
+
+metrics = Metrics()
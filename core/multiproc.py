@@ -0,0 +1,114 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: multiproc.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/20 : 上午10:15
+import signal
+import Queue
+import multiprocessing
+
+from AnsiColor import Print_W
+from scanwork import ScanBackup, shutdown
+from journal import Journal
+from sink import sink
+from metrics import metrics
+from ranking import hit_model
+
+
+def split_targets(targets, procs):
+    """
+    按主机将目标分给各进程，同一主机只在一个进程中扫描，主机限速在进程内有效
+    :param targets: [{"id": , "target": }, ...]
+    :param procs: 进程数
+    :return: [[target_info, ...], ...] 空的分组不返回
+    """
+    groups = {}
+    for info in targets:
+        host = ScanBackup.host_parse(info.get("target").strip())[0]
+        groups.setdefault(host, []).append(info)
+    shards = [[] for i in range(procs)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(shards, key=len).extend(group)
+    # 各进程内保持原有顺序
+    order = dict((id(info), i) for i, info in enumerate(targets))
+    for shard in shards:
+        shard.sort(key=lambda info: order[id(info)])
+    return [shard for shard in shards if shard]
+
+
+def _terminate(signum, frame):
+    # 信号处理可能打断持有锁的代码，只置位停止标志，由扫描循环结束后正常退出
+    shutdown.set()
+
+
+def _worker(index, option, targets, queue, scan):
+    """
+    工作进程：Ctrl-C 由父进程处理，SIGTERM 时完成进行中的请求、写入日志后退出
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _terminate)
+    sink.forward(queue)
+    metrics.forward(queue, index)
+    # sqlite 连接不能跨 fork 使用，各进程打开自己的连接
+    journal = option.get("journal")
+    option = dict(option, targets=targets, journal=Journal(journal.path) if journal else None)
+    try:
+        scan(option)
+    finally:
+        metrics.stop()
+        hit_model.save()
+        if option.get("journal"): option["journal"].close()
+
+
+def _pump(queue, timeout):
+    """
+    处理子进程发来的结果与指标
+    :return: 是否收到消息
+    """
+    try:
+        message = queue.get(True, timeout)
+    except Queue.Empty:
+        return False
+    while True:
+        if message[0] == "sink":
+            sink.put(message[1])
+        elif message[0] == "metrics":
+            metrics.merge(message[1], message[2])
+        try:
+            message = queue.get_nowait()
+        except Queue.Empty:
+            return True
+
+
+def run_sharded(option, procs, scan):
+    """
+    多进程扫描：目标按主机分给 procs 个进程，各自运行扫描引擎，
+    结果、进度与指标经队列汇总到本进程统一输出
+    :param option: 选项，目标为列表
+    :param procs: 进程数
+    :param scan: 扫描目标列表的函数 scan(option)
+    :return: 是否被中断
+    """
+    queue = multiprocessing.Queue()
+    workers = []
+    interrupted = False
+    for index, targets in enumerate(split_targets(option.get("targets"), procs)):
+        worker = multiprocessing.Process(target=_worker, args=(index, option, targets, queue, scan))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            _pump(queue, 0.2)
+    except KeyboardInterrupt:
+        Print_W("中断扫描，结束工作进程...")
+        interrupted = True
+        for worker in workers:
+            worker.terminate()
+        while any(worker.is_alive() for worker in workers):
+            _pump(queue, 0.2)
+    # 进程退出前已写入队列的消息
+    while _pump(queue, 0.2):
+        pass
+    return interrupted
@@ -0,0 +1,82 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: preflight.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/17 : 上午9:25
+from threadpool import ThreadPool, makeRequests
+from connpool import HttpConnection
+from scanwork import ScanBackup, TargetClient
+from baseline import Calibrator
+
+
+class Unreachable(Exception):
+    """
+    目标无法解析或无法连接
+    """
+
+
+def check_target(target, option):
+    """
+    检查目标能否建立连接，错误页面基线在扫描初始化时校准
+    :param target:
+    :return: 是否可扫描
+    """
+    host, port, main_path = ScanBackup.host_parse(target)
+    conn = HttpConnection(host, port, option.get("timeout"))
+    if conn.closed: return False
+    conn.close()
+    return True
+
+
+def calibrate_target(target, option, config):
+    """
+    检查目标能否建立连接，可连接时校准错误页面基线
+    :return: 完成校准的 Calibrator，无法连接时为 None
+    """
+    if not check_target(target, option): return None
+    client = TargetClient(target, option)
+    try:
+        calibrator = Calibrator(client, config)
+        calibrator.calibrate()
+        return calibrator
+    finally:
+        client.close()
+
+
+def preflight(option, config=None):
+    """
+    在扫描开始前并行检查全部目标，给出 config 时同时校准错误页面基线，
+    校准结果保存在各目标的 "calibrator" 中供 ScanBackup 使用
+    :param option:
+    :param config:
+    :return: 无法连接的目标集合
+    """
+    journal = option.get("journal")
+    targets = [t.get("target").strip() for t in option.get("targets")]
+    if journal and option.get("resume"):
+        targets = [t for t in targets if not journal.target_done(t)]
+    if not targets: return set()
+    failed, calibrators = set(), {}
+
+    def callback(request, result):
+        if not result:
+            failed.add(request.args[0])
+        elif config is not None:
+            calibrators[request.args[0]] = result
+
+    def exc_callback(request, exc_info):
+        failed.add(request.args[0])
+
+    if config is None:
+        args = [((t, option), {}) for t in targets]
+    else:
+        args = [((t, option, config), {}) for t in targets]
+    pool = ThreadPool(min(len(targets), max(option.get("thread"), 50)))
+    for req in makeRequests(check_target if config is None else calibrate_target, args, callback, exc_callback):
+        pool.putRequest(req)
+    pool.wait()
+    pool.dismissWorkers(len(pool.workers))
+    for target_info in option.get("targets"):
+        target_info["calibrator"] = calibrators.get(target_info.get("target").strip())
+    return failed
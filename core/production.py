@@ -4,9 +4,14 @@
 # Description: production.py python2.7
 # License: Apache Licence
 # CreateTime: 2018/6/26 : 下午11:16
+import os
 import time
+import json
+import hashlib
 
 from config.config import conf
+from wordlist import Wordlist, Product, unique
+from ranking import hit_model
 
 
 class Production(object):
@@ -16,81 +21,72 @@ class Production(object):
 
     def __init__(self, target, config):
         self.target = target
-        self.re_rules = set()
+        self.re_rules = None
+        # 时间与域名主干按生成规则归类统计发现次数，其余主干按原文
+        self.stem_keys = {}
         self.rules = config.get("match")
         self.suffix = config.get("suffix")
         self.host_suffix = config.get("host_suffix")
+        self.config = config
         self.path_handle()
 
     def path_handle(self):
         """
-        字典生成器
+        字典生成器，字典以 前缀 × 主干 × 后缀 的分解形式保存，不展开
+        与目标无关的部分由 static_rules 缓存，这里只生成域名主干
         """
-        for key in self.rules:
-            rule = self.rules.get(key)
-            if key == "time":
-                for f in rule:
-                    if "format" in f:
-                        for_mat = f.get("format")
-                        for_mat = for_mat.replace("yyyy", "%Y").replace("mm", "%m").replace("dd", "%d")
-                        for i in range(1, 7):
-                            self.re_rules.add(time.strftime(for_mat, time.localtime(time.time() - 86400 * i)))
-            if key == "host":
-                for r in rule:
-                    _target = ""
-                    if "replace" in r:
-                        _rule = r.get("replace")
-                        _tmp = _rule.split("|")
-                        _target = self.target.replace(_tmp[0], _tmp[1] if _tmp[1] != "*" else " ")
-                    elif "delete" in r:
-                        _rule = r.get("delete")
-                        _tmp = _rule.split("|")
-                        _target = self.delete(self.target, _tmp)
-                    self.re_rules.add(_target)
-
-        rule = self.rules.get("adding")
-        target = list(self.re_rules)
-        for r in rule:
+        static = static_rules(self.config)
+        stems = []
+        self.stem_keys = dict((t, "<time>") for t in static.get("time"))
+        for r in self.rules.get("host"):
             _target = ""
-            for t in target:
-                _rule = r.get("adding")
+            if "replace" in r:
+                _rule = r.get("replace")
                 _tmp = _rule.split("|")
-                if _tmp[0] != "": _target = _tmp[0] + t
-                if _tmp[1] != "": _target = t + _tmp[1]
-                self.re_rules.add(_target)
-
-        rule = self.rules.get("common")
-        for r in rule:
-            self.re_rules.add(r)
-        rule = self.rules.get("range")
-        for r in rule:
-            [s, e] = r.split("|")
-            if s == "1": [self.re_rules.add(str(i)) for i in range(int(s), int(e) + 1)]
-            if s == "a": [self.re_rules.add(chr(i + ord('A')).lower()) for i in xrange(26)]
-
-        self.suffix_handle(self.re_rules)
-
-        rule = self.rules.get("alone")
-        for r in rule:
-            self.re_rules.add(r)
-
-    def suffix_handle(self, rules):
+                _target = self.target.replace(_tmp[0], _tmp[1] if _tmp[1] != "*" else " ")
+                self.stem_keys.setdefault(_target, "<host:replace:%s>" % _rule)
+            elif "delete" in r:
+                _rule = r.get("delete")
+                _tmp = _rule.split("|")
+                _target = self.delete(self.target, _tmp)
+                self.stem_keys.setdefault(_target, "<host:delete:%s>" % _rule)
+            stems.append(_target)
+        stems = unique([t for t in static.get("time") + stems if t])
+        _stems = set(stems)
+        words = [w for w in static.get("words") if w not in _stems]
+
+        suffix = static.get("suffix")
+        # adding 规则只作用于时间与域名主干
+        self.re_rules = Wordlist([
+            self.product(static.get("prefixes"), stems, suffix),
+            self.product([""], stems, static.get("adding")),
+            self.product([""], words, suffix),
+            self.product([""], static.get("alone"), [""]),
+        ])
+
+    def product(self, prefixes, stems, suffixes):
+        """
+        启用排序时按发现统计为各因子加权
+        """
+        if not hit_model.enabled: return Product(prefixes, stems, suffixes)
+        return Product(prefixes, stems, suffixes, (hit_model.weights("prefix", prefixes),
+                                                   hit_model.weights("stem", [self.stem_keys.get(s, s) for s in stems]),
+                                                   hit_model.weights("suffix", suffixes)))
+
+    def features(self, path):
         """
-        字典后缀处理
-        :param rules:
+        路径的统计归类
+        :return: (prefix, stem, suffix) 或 None
         """
-        re_rules = set()
-        _path = list(rules)
-        for _target in _path:
-            if _target == "": continue
-            for suffix in self.suffix:
-                re_rules.add(_target + suffix)
-        self.re_rules = re_rules
+        features = self.re_rules.split(path)
+        if features is None: return None
+        prefix, stem, suffix = features
+        return prefix, self.stem_keys.get(stem, stem), suffix
 
     def getWorkPath(self):
         """
         URI路径获取
-        :return:
+        :return: Wordlist
         """
         return self.re_rules
 
@@ -113,15 +109,150 @@ class Production(object):
 
     def getSuffix(self, host):
         """
-        获取后缀
+        获取后缀，返回最长的匹配
         :param host:
         :return:
         """
-        for suffix in self.host_suffix:
-            if host.endswith(suffix):
-                return "." + suffix
+        return suffix_index(self.host_suffix).longest(host)
+
+
+class SuffixIndex(object):
+    """
+    按标签倒序组织的域名后缀前缀树，支持 *.xx 通配及 !xx 例外规则
+    """
+
+    def __init__(self, suffixes):
+        self.root = {}
+        for suffix in suffixes:
+            labels = suffix.lower().split(".")
+            node = self.root
+            if labels[0].startswith("!"):
+                for label in reversed(labels[1:]):
+                    node = node.setdefault(label, {})
+                node.setdefault("!", set()).add(labels[0][1:])
+                continue
+            for label in reversed(labels):
+                node = node.setdefault(label, {})
+            node[""] = True
+
+    def longest(self, host):
+        """
+        最长后缀匹配，后缀之前至少保留一个标签
+        :param host:
+        :return: ".后缀" 或 None
+        """
+        labels = host.lower().split(".")
+        n, node, match = len(labels), self.root, 0
+        for i in xrange(n - 1):
+            label = labels[n - 1 - i]
+            if label in node.get("!", ()):
+                # 例外规则：后缀为例外规则去掉最左标签
+                match = i
+                break
+            if "*" in node:
+                match = i + 1
+            child = node.get(label)
+            if child is None:
+                break
+            node = child
+            if "" in node: match = i + 1
+        if not match: return None
+        return "." + ".".join(labels[n - match:])
+
+
+def time_rules(rules):
+    """
+    最近 6 天的日期主干
+    """
+    stems = []
+    for f in rules.get("time"):
+        if "format" in f:
+            for_mat = f.get("format")
+            for_mat = for_mat.replace("yyyy", "%Y").replace("mm", "%m").replace("dd", "%d")
+            for i in range(1, 7):
+                stems.append(time.strftime(for_mat, time.localtime(time.time() - 86400 * i)))
+    return unique(stems)
+
+
+def build_static_rules(rules, suffix):
+    """
+    生成与目标无关的字典部分
+    :param rules: work_rule.json
+    :param suffix: file_suffix.json
+    :return:
+    """
+    stems = time_rules(rules)
+    prefixes, adding = [""], []
+    for r in rules.get("adding"):
+        _tmp = r.get("adding").split("|")
+        if _tmp[1] != "":
+            adding.append(_tmp[1])
+        elif _tmp[0] != "":
+            prefixes.append(_tmp[0])
+
+    words = []
+    for r in rules.get("common"):
+        words.append(r)
+    for r in rules.get("range"):
+        [s, e] = r.split("|")
+        if s == "1": words.extend([str(i) for i in range(int(s), int(e) + 1)])
+        if s == "a": words.extend([chr(i + ord('A')).lower() for i in xrange(26)])
+    _stems = set(stems)
+
+    suffix = unique(suffix)
+    return {"time": stems, "prefixes": unique(prefixes), "adding": unique([a + f for a in adding for f in suffix]),
+            "words": unique([w for w in words if w and w not in _stems]), "suffix": suffix,
+            "alone": unique(rules.get("alone"))}
+
+
+_static_rules = {}
+
+
+def static_rules(config):
+    """
+    与目标无关的字典部分，进程内只计算一次，并按 work_rule.json、file_suffix.json 及日期缓存到磁盘
+    :param config:
+    :return:
+    """
+    rules, suffix = config.get("match"), config.get("suffix")
+    key = hashlib.sha1(json.dumps([rules, suffix, time.strftime("%Y%m%d")], sort_keys=True)).hexdigest()
+    static = _static_rules.get(key)
+    if static is not None: return static
+
+    cache_dir = os.path.join(config.get("root"), "cache")
+    cache_path = os.path.join(cache_dir, "wordlist-%s.json" % key)
+    try:
+        with open(cache_path) as cache_file:
+            static = json.load(cache_file)
+    except (IOError, ValueError):
+        static = build_static_rules(rules, suffix)
+        try:
+            if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+            # 清理其他日期或旧规则的缓存
+            for name in os.listdir(cache_dir):
+                if name.startswith("wordlist-"): os.remove(os.path.join(cache_dir, name))
+            with open(cache_path + ".tmp", "w") as cache_file:
+                json.dump(static, cache_file)
+            os.rename(cache_path + ".tmp", cache_path)
+        except (IOError, OSError):
+            pass
+    _static_rules[key] = static
+    return static
+
+
+_suffix_index = {}
+
+
+def suffix_index(host_suffix):
+    """
+    同一份后缀表只建一次索引
+    """
+    index = _suffix_index.get(id(host_suffix))
+    if index is None:
+        index = _suffix_index[id(host_suffix)] = SuffixIndex(host_suffix)
+    return index
 
 
 if __name__ == '__main__':
     p = Production("www.asd.com", conf)
-    print p.getWorkPath()
+    print list(p.getWorkPath())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: ranking.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/21 : 下午3:20
+import os
+import json
+import fcntl
+import threading
+
+KINDS = ("prefix", "stem", "suffix")
+# 本地的一次发现相当于内置先验中的 5 次，约 20 次发现后本地统计占主导
+HISTORY_WEIGHT = 5
+# 先验与历史中都没有的因子
+ALPHA = 0.1
+
+
+class HitModel(object):
+    """
+    按前缀、主干、后缀统计的发现次数，决定字典的遍历顺序。
+    内置先验来自 resource/hit_prior.json，本地历史保存在 cache/hits.json
+    """
+
+    def __init__(self):
+        self.prior = {}
+        self.history = dict((kind, {}) for kind in KINDS)
+        # 本次运行新增的发现，保存时与文件中的统计合并
+        self.added = dict((kind, {}) for kind in KINDS)
+        self.path = None
+        self.enabled = False
+        self.lock = threading.Lock()
+
+    def load(self, prior, path=None):
+        """
+        :param prior: 内置先验 {kind: {key: 次数}}
+        :param path: 本地历史文件，None 时不读写
+        """
+        self.prior = prior or {}
+        self.path = path
+        self.enabled = True
+        if path: self.history = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                stats = json.load(f)
+        except (IOError, ValueError):
+            stats = {}
+        return dict((kind, stats.get(kind) or {}) for kind in KINDS)
+
+    def weight(self, kind, key):
+        return self.prior.get(kind, {}).get(key, 0) + HISTORY_WEIGHT * self.history[kind].get(key, 0) + ALPHA
+
+    def weights(self, kind, keys):
+        return [self.weight(kind, key) for key in keys]
+
+    def record(self, features):
+        """
+        记录一次发现
+        :param features: (prefix, stem, suffix)，主干为 Production.features 给出的归类
+        """
+        if not self.enabled or features is None: return
+        with self.lock:
+            for kind, key in zip(KINDS, features):
+                self.history[kind][key] = self.history[kind].get(key, 0) + 1
+                self.added[kind][key] = self.added[kind].get(key, 0) + 1
+
+    def save(self):
+        """
+        新增的发现合并到历史文件，多个进程同时保存时以文件锁串行
+        """
+        with self.lock:
+            if not self.path or not any(self.added.values()): return
+            added, self.added = self.added, dict((kind, {}) for kind in KINDS)
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory): os.makedirs(directory)
+            with open(self.path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                stats = self._read()
+                for kind in KINDS:
+                    for key, count in added[kind].items():
+                        stats[kind][key] = stats[kind].get(key, 0) + count
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(stats, f, indent=1, sort_keys=True)
+                os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError):
+            pass
+
+
+hit_model = HitModel()
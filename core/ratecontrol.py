@@ -0,0 +1,339 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: ratecontrol.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/16 : 上午10:30
+import time
+import threading
+
+# 请求结果分类
+OK, SLOW, THROTTLE, ERROR = range(4)
+# 失败率(指数平均)达到该值时才视为主机整体故障，个别路径的连接重置不影响限速
+ERROR_RATE = 0.5
+# 请求间隔的半衰期(秒)
+DELAY_HALF_LIFE = 2.0
+
+
+def classify(response, latency=0, base_latency=None):
+    """
+    请求结果分类，429/503 为限流，明显慢于该主机最快响应为变慢
+    :param response: (status, html, headers) 或 None
+    :param latency: 本次耗时
+    :param base_latency: 该主机的最小耗时
+    :return:
+    """
+    if response is None or not response[0]: return ERROR
+    if response[0] in ("429", "503"): return THROTTLE
+    if base_latency is not None and latency > max(3 * base_latency, 0.5): return SLOW
+    return OK
+
+
+class RttEstimator(object):
+    """
+    平滑往返时间估计(SRTT/RTTVAR，同 TCP 的 RTO 计算)，超时后指数退避直到下一个有效样本
+    """
+
+    def __init__(self, max_timeout, min_timeout=0.5):
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.srtt = None
+        self.rttvar = 0.0
+        self.backoffs = 0
+        self.lock = threading.Lock()
+
+    def sample(self, rtt):
+        """
+        加入一个往返时间样本
+        """
+        with self.lock:
+            if self.srtt is None:
+                self.srtt, self.rttvar = rtt, rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.backoffs = 0
+
+    def backoff(self):
+        """
+        发生超时，超时时间加倍
+        """
+        with self.lock:
+            self.backoffs = min(self.backoffs + 1, 6)
+
+    def timeout(self):
+        """
+        当前超时时间，没有样本时为最大值
+        """
+        if self.srtt is None: return self.max_timeout
+        rto = (self.srtt + 4 * self.rttvar) * (1 << self.backoffs)
+        return min(self.max_timeout, max(self.min_timeout, rto))
+
+
+class HostRtt(object):
+    """
+    单主机的连接与读取往返时间
+    """
+
+    def __init__(self, max_timeout):
+        self.connect = RttEstimator(max_timeout)
+        self.read = RttEstimator(max_timeout)
+
+
+class HostLimiter(object):
+    """
+    单主机 AIMD 限速：并发窗口慢启动、加性增长，限流或失败率持续偏高时减半，
+    窗口已减到 1 仍被限流时才拉开请求间隔，间隔按时间衰减。同时维护该主机的往返时间以计算超时
+    """
+
+    def __init__(self, max_window, max_delay=3.0, timeout=3):
+        self.max_window = max(1, max_window)
+        self.max_delay = max_delay
+        self.window = min(2.0, self.max_window)
+        self.threshold = float(self.max_window)
+        self.delay = 0.0
+        self.delay_time = 0.0
+        self.next_time = 0.0
+        self.errors = 0.0
+        self.inflight = 0
+        self.base_latency = None
+        self.cut_time = 0.0
+        self.rtt = HostRtt(timeout)
+        self.cond = threading.Condition()
+
+    def limit(self):
+        """
+        当前允许的并发数
+        """
+        return int(self.window)
+
+    def ready(self, now=None):
+        """
+        是否可以立即发出请求
+        """
+        return self.inflight < int(self.window) and (now or time.time()) >= self.next_time
+
+    def acquire(self, block=True, cancel=None):
+        """
+        占用一个并发名额
+        :param block: 名额不足时是否等待
+        :param cancel: 等待中定期检查，返回 True 时放弃等待
+        :return: 是否成功
+        """
+        with self.cond:
+            while True:
+                now = time.time()
+                if self.ready(now): break
+                if not block or (cancel and cancel()): return False
+                self.cond.wait(min(0.5, max(0.01, self.next_time - now)) if self.inflight < int(self.window) else 0.5)
+            self.inflight += 1
+            self._decay(now)
+            # 只有窗口为 1 时按间隔发出请求
+            if self.delay and self.window < 2: self.next_time = now + self.delay
+            return True
+
+    def _decay(self, now):
+        if self.delay:
+            self.delay *= 0.5 ** ((now - self.delay_time) / DELAY_HALF_LIFE)
+            if self.delay < 0.01: self.delay = 0.0
+        self.delay_time = now
+
+    def cancel(self):
+        """
+        归还未使用的名额，不调整窗口
+        """
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+
+    def release(self, outcome, latency=0):
+        """
+        归还名额并根据结果调整窗口
+        :param outcome: OK/SLOW/THROTTLE/ERROR
+        :param latency: 请求耗时
+        """
+        with self.cond:
+            self.inflight -= 1
+            now = time.time()
+            self._decay(now)
+            self.errors = self.errors * 0.9 + (0.1 if outcome == ERROR else 0.0)
+            if outcome == OK:
+                if self.base_latency is None or latency < self.base_latency: self.base_latency = latency
+                if self.window < self.threshold:
+                    self.window = min(self.max_window, self.window + 1)
+                else:
+                    self.window = min(self.max_window, self.window + 1.0 / self.window)
+            elif outcome == THROTTLE or (outcome == ERROR and self.errors >= ERROR_RATE):
+                # 同一往返时间内的多个失败只减半一次
+                if now - self.cut_time < max(latency, self.base_latency or 0):
+                    self.cond.notify_all()
+                    return
+                self.cut_time = now
+                if self.window < 2:
+                    self.delay = min(self.max_delay, max(self.delay * 2, 0.05))
+                    self.next_time = max(self.next_time, now + self.delay)
+                self.threshold = max(1.0, self.window / 2)
+                self.window = self.threshold
+            self.cond.notify_all()
+
+
+class CircuitBreaker(object):
+    """
+    目标熔断：连续 threshold 次连接失败或超时后暂停 cooldown 秒，之后只放行一个探测请求，
+    成功则恢复，失败则暂停时间加倍，连续熔断 trips 次后中止目标
+    """
+    CLOSED, OPEN, HALF_OPEN = range(3)
+
+    def __init__(self, threshold=10, cooldown=5.0, trips=3):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.trips = trips
+        self.state = self.CLOSED
+        self.failures = 0
+        self.tripped = 0
+        self.open_until = 0.0
+        self.aborted = False
+        self.cond = threading.Condition()
+
+    def ready(self):
+        """
+        是否可以发出请求，不改变状态
+        """
+        if self.aborted: return False
+        return self.state == self.CLOSED or (self.state == self.OPEN and time.time() >= self.open_until)
+
+    def allow(self, block=False):
+        """
+        请求放行，暂停结束后的首个请求作为探测
+        :param block: 暂停或探测中时是否等待
+        :return: 是否放行，目标中止时为 False
+        """
+        with self.cond:
+            while True:
+                if self.aborted: return False
+                if self.state == self.CLOSED: return True
+                now = time.time()
+                if self.state == self.OPEN and now >= self.open_until:
+                    self.state = self.HALF_OPEN
+                    return True
+                if not block: return False
+                self.cond.wait(max(0.05, self.open_until - now) if self.state == self.OPEN else 1)
+
+    def success(self):
+        with self.cond:
+            self.failures = 0
+            self.tripped = 0
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                self.cond.notify_all()
+
+    def failure(self):
+        """
+        记录一次连接失败或超时
+        :return: 本次是否触发熔断
+        """
+        if not self.threshold: return False
+        with self.cond:
+            self.failures += 1
+            if self.aborted or self.state == self.OPEN: return False
+            if self.state == self.CLOSED and self.failures < self.threshold: return False
+            self.tripped += 1
+            if self.tripped >= self.trips:
+                self.aborted = True
+            else:
+                self.state = self.OPEN
+                self.open_until = time.time() + self.cooldown * (1 << (self.tripped - 1))
+            self.cond.notify_all()
+            return True
+
+
+class Budget(object):
+    """
+    目标预算：请求数、扫描时间、接收字节数与发现数，任一达到上限后目标停止扫描，0 为不限制
+    """
+
+    def __init__(self, requests=0, seconds=0, received=0, findings=0):
+        self.max_requests = requests
+        self.max_seconds = seconds
+        self.max_received = received
+        self.max_findings = findings
+        self.requests = 0
+        self.received = 0
+        self.findings = 0
+        self.started = None
+        # 达到的上限，未达到为 None
+        self.spent = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.started is None: self.started = time.time()
+
+    def charge(self, requests=0, received=0, findings=0):
+        """
+        计入消耗
+        :return: 是否超出请求数或发现数上限，超出部分的结果不再输出
+        """
+        with self.lock:
+            self.requests += requests
+            self.received += received
+            self.findings += findings
+            return bool(self.max_requests and self.requests > self.max_requests or
+                        self.max_findings and self.findings > self.max_findings)
+
+    def check(self):
+        """
+        检查各项上限
+        :return: 本次检查是否刚达到上限
+        """
+        if self.spent is not None: return False
+        spent = None
+        if self.max_findings and self.findings >= self.max_findings:
+            spent = "发现数 %d" % self.findings
+        elif self.max_requests and self.requests >= self.max_requests:
+            spent = "请求数 %d" % self.requests
+        elif self.max_received and self.received >= self.max_received:
+            spent = "流量 %.1fMB" % (self.received / 1048576.0)
+        elif self.max_seconds and self.started is not None and time.time() - self.started >= self.max_seconds:
+            spent = "扫描时间 %d 秒" % self.max_seconds
+        if spent is None: return False
+        with self.lock:
+            if self.spent is not None: return False
+            self.spent = spent
+        return True
+
+
+class RateController(object):
+    """
+    按主机管理 HostLimiter，主机的最后一个扫描结束后释放
+    """
+
+    def __init__(self, max_window, max_delay=3.0, timeout=3):
+        self.max_window = max_window
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.limiters = {}
+        # 主机的引用计数
+        self.refs = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        """
+        主机对应的限速器，同一主机的多个扫描共享，用完后以 release 释放
+        """
+        with self.lock:
+            limiter = self.limiters.get(host)
+            if limiter is None:
+                limiter = self.limiters[host] = HostLimiter(self.max_window, self.max_delay, self.timeout)
+            self.refs[host] = self.refs.get(host, 0) + 1
+            return limiter
+
+    def release(self, host):
+        with self.lock:
+            if host not in self.refs: return
+            self.refs[host] -= 1
+            if not self.refs[host]:
+                del self.refs[host]
+                del self.limiters[host]
+
+
+controller = RateController(10)
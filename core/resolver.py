@@ -0,0 +1,78 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: resolver.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/9 : 上午9:48
+import time
+import socket
+import threading
+from collections import OrderedDict
+
+from threadpool import ThreadPool, makeRequests
+
+
+class Resolver(object):
+    """
+    带 TTL 与失败缓存的域名解析，缓存超过 max_size 个域名时淘汰最早写入的
+    """
+
+    def __init__(self, ttl=300, negative_ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def resolve(self, host):
+        """
+        解析域名，IP 直接返回
+        :param host:
+        :return: IP 或 None(解析失败)
+        """
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(host)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        try:
+            socket.inet_aton(host)
+            return host
+        except socket.error:
+            pass
+        try:
+            ip = socket.gethostbyname(host)
+            expire = now + self.ttl
+        except (socket.error, UnicodeError):
+            ip = None
+            expire = now + self.negative_ttl
+        with self.lock:
+            self.cache.pop(host, None)
+            self.cache[host] = (ip, expire)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return ip
+
+    def prefetch(self, hosts, thread_num=50):
+        """
+        并行预解析
+        :param hosts: 域名列表
+        :param thread_num: 解析线程数
+        :return: 解析失败的域名集合
+        """
+        hosts = list(set(hosts))
+        if not hosts: return set()
+        failed = set()
+
+        def callback(request, ip):
+            if ip is None: failed.add(request.args[0])
+
+        pool = ThreadPool(min(len(hosts), thread_num))
+        for req in makeRequests(self.resolve, hosts, callback):
+            pool.putRequest(req)
+        pool.wait()
+        pool.dismissWorkers(len(pool.workers))
+        return failed
+
+
+resolver = Resolver()
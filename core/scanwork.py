@@ -4,63 +4,58 @@
 # Description: scanwork.py python2.7
 # License: Apache Licence 
 # CreateTime: 2018/6/26 : 下午4:49
+import re
 import time
-import zlib
+import itertools
+import socket
 import urllib
 import urlparse
+import threading
 
-from socket import *
 from AnsiColor import *
 from threadpool import *
 from match import MatchHandel
 from production import Production
+from connpool import ConnectionPool, HttpConnection, header_get, decode_body, thread_received
+from eventloop import EventEngine
+from baseline import Calibrator
+from sink import sink
+from metrics import metrics
+from ranking import hit_model
+from ratecontrol import controller, classify, CircuitBreaker, Budget, OK, ERROR
 
-_https = False
-try:
-    import ssl
+# 外部停止请求(工作进程收到 SIGTERM)，置位后不再取新的路径与目标，进行中的请求完成后正常退出
+shutdown = threading.Event()
 
-    _https = True
-except ImportError:
-    print "import ssl error"
-    pass
 
+class Deferred(Exception):
+    """
+    非阻塞发送时目标熔断暂停或主机限速未放行，路径由调度器稍后重新分发
+    """
 
-class ScanBackup(object):
+
+class TargetClient(object):
     """
-    扫描备份
+    目标的 HTTP 请求：连接池、主机限速、目标熔断与预算，预检阶段的错误页面校准与扫描共用
     """
 
-    def __init__(self, target, option, config):
-        self.timeout = None
-        self.status = False
+    def __init__(self, target, option):
         self.option = option
+        self.peek = int(option.get("peek") or 1024)
+        self.probe = option.get("probe") or "get"
+        self.pool = ConnectionPool() if int(option.get("keepalive", 1)) else None
         self.target = target
-        self.matchHandel = MatchHandel(config.get("rules"))
         self.host, self.port, self.main_path = self.host_parse(target)
-        self.output_path = config.get("root") + "/" + target.replace(":", "-") + ".txt"
-        self.output_file = open(self.output_path, "a")
-        prod = Production(self.host, config)
-        self.paths = prod.getWorkPath()
-        self.path_num = len(self.paths)
-        self._Error_ = None
-        self.getErr404Page()
-        # self.getNormalPage()
-        self.requests = makeRequests(self.do_something, self.paths, self.print_result, self.handle_exception)
+        self.limiter = controller.get(self.host) if int(option.get("adaptive", 1)) else None
+        self.rtt = self.limiter.rtt if self.limiter else None
+        self.closed = False
+        self.breaker = CircuitBreaker(int(option.get("breaker", 10)))
+        self.budget = Budget(int(option.get("maxreq") or 0), float(option.get("maxtime") or 0),
+                             int(option.get("maxbytes") or 0), int(option.get("maxhits") or 0))
+        self.journal = option.get("journal")
 
-    def getErr404Page(self):
-        """
-        获取错误页面关键字
-        """
-        stime = time.time()
-        self._Error_ = self.do_something("get_404_page")
-        etime = time.time()
-        if (etime - stime) > 3: self.timeout = 1
-
-    # def getNormalPage(self):
-    #     s, b, h = self.do_something("")
-    #     self.status = (s != "200" or s == "404")
-
-    def host_parse(self, target):
+    @staticmethod
+    def host_parse(target):
         """
         host 解析
         :param target:
@@ -74,109 +69,324 @@ class ScanBackup(object):
         path = url.path or "/"
         return host, port, path
 
-    def do_something(self, path):
+    def connect_timeout(self):
+        """
+        连接超时，按主机往返时间计算
+        """
+        return self.rtt.connect.timeout() if self.rtt else self.option.get("timeout")
+
+    def read_timeout(self):
+        """
+        读取超时，按主机往返时间计算
+        """
+        return self.rtt.read.timeout() if self.rtt else self.option.get("timeout")
+
+    def build_request(self, path, method="GET"):
         """
-        识别rdp服务
+        构造请求报文
         :param path: 请求地址路径
+        :param method: 请求方法
         :return:
         """
+        if self.probe == "get":
+            extra = 'Accept-Encoding: gzip, deflate\r\n'
+        elif method == "GET":
+            # 只请求文件头部，避免服务端推送完整的大文件
+            extra = 'Accept-Encoding: identity\r\nRange: bytes=0-%d\r\n' % (self.peek - 1)
+        else:
+            extra = 'Accept-Encoding: identity\r\n'
+        return '%s %s%s HTTP/1.1\r\n' \
+               'Host: %s:%s\r\n' \
+               'Connection: %s\r\n' \
+               '%s' \
+               'User-Agent: Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) ' \
+               'Chrome/44.0.2403.125 Safari/537.36\r\n' \
+               'Accept: */*\r\n\r\n' % (method, self.main_path, urllib.quote(path).replace("%5f", "/"),
+                                          self.host, self.port, "keep-alive" if self.pool else "close", extra)
 
-        get_str = 'GET %s%s HTTP/1.1\r\n' \
-                  'Host: %s:%s\r\n' \
-                  'Connection: close\r\n' \
-                  'Accept-Encoding: gzip, deflate\r\n' \
-                  'User-Agent: Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) ' \
-                  'Chrome/44.0.2403.125 Safari/537.36\r\n' \
-                  'Accept: */*\r\n\r\n' % (self.main_path, urllib.quote(path).replace("%5f", "/"), self.host, self.port)
+    def do_something(self, path, block=True):
+        """
+        请求单个路径
+        :param path: 请求地址路径
+        :param block: 熔断暂停或限速时是否等待，为 False 时抛出 Deferred
+        :return: status, html, headers
+        """
+        return self.fetch([path], block)[0]
 
-        conn, version, status, reason, length, html, headers = None, "", "", "", 0, "", {}
-        try:
-            conn = self.sockHttp(self.host, self.port, self.timeout or self.option.get("timeout"))
-            if conn is None: return status, html, headers
-            conn.send(get_str)
-            recv_data, byte_num = "", 0
-            while True:
-                recv_data += conn.recv(100)
-                byte_num += 100
-                if recv_data.find("\r\n\r\n") >= 0:
-                    recv_data += conn.recv(100)
-                    break
-                if byte_num > 1000: break
+    def do_pipeline(self, paths, block=True):
+        """
+        在同一连接上管线化请求多个路径
+        :param paths: 请求地址路径列表
+        :param block: 同 do_something
+        :return: [(status, html, headers), ...]
+        """
+        return self.fetch(paths, block)
 
-            line = recv_data.split("\r\n")[0]
+    def fetch(self, paths, block=True):
+        """
+        发送请求并读取响应，head 模式先以 HEAD 筛选，只对可能命中的路径取主体
+        :param paths: 请求地址路径列表
+        :param block: 同 do_something
+        :return:
+        """
+        if self.probe == "head":
+            responses = self.send([("HEAD", path) for path in paths], block)
+            need = [i for i, response in enumerate(responses) if self.need_body(response)]
+            for i, response in zip(need, self.send([("GET", paths[i]) for i in need])):
+                responses[i] = response
+        else:
+            responses = self.send([("GET", path) for path in paths], block)
+        return [self.decode(response) for response in responses]
+
+    def send(self, requests, block=True):
+        """
+        发送请求，超时时间随往返时间收紧，主机有过响应时失败的请求以退避后的超时重试一次
+        :param requests: [(method, path), ...]
+        :param block: 首次发送是否等待熔断与限速，重试总是等待
+        :return: [(status, html, headers) 或 None, ...]
+        """
+        responses = self._send(requests, block)
+        retry = self.rtt is not None and self.rtt.connect.srtt is not None
+        missing = [i for i, response in enumerate(responses) if response is None] if retry else []
+        for i, response in zip(missing, self._send([requests[i] for i in missing])):
+            responses[i] = response
+        return responses
+
+    def _send(self, requests, block=True):
+        """
+        受目标熔断与主机限速器控制发送，按本批最差的结果调整限速
+        :raise Deferred: 非阻塞时未放行
+        """
+        if not requests: return []
+        # 先占用限速名额再经过熔断，熔断未放行时归还名额，半开状态的探测请求一定会发出
+        limiter = self.limiter
+        if limiter is not None and not limiter.acquire(block=block, cancel=lambda: self.breaker.aborted):
+            if not block and not self.breaker.aborted: raise Deferred()
+            return [None] * len(requests)
+        if not self.breaker.allow(block=block):
+            if limiter is not None: limiter.cancel()
+            if not block and not self.breaker.aborted: raise Deferred()
+            return [None] * len(requests)
+        if limiter is None:
+            responses = self._request(requests)
+        else:
+            stime, responses = time.time(), []
             try:
-                [version, status, reason] = line.split(None, 2)
-            except ValueError:
-                try:
-                    [version, status] = line.split(None, 1)
-                    reason = ""
-                except ValueError:
-                    version = ""
-
-            index = recv_data.find("\r\n\r\n")
-            if index >= 0:
-                header = recv_data[0:index]
-                recv_data = recv_data[index + 4:]
-                header_lines = header.split("\r\n")
-                status_line = header_lines[0]
-                for line in header_lines[1:]:
-                    line = line.strip("\r\n")
-                    if len(line) == 0:
-                        continue
-                    colonIndex = line.find(":")
-                    fieldName = line[:colonIndex]
-                    fieldValue = line[colonIndex + 1:].strip()
-                    headers[fieldName] = fieldValue
-            else:
-                return status, html, length
+                responses = self._request(requests)
+            finally:
+                latency = (time.time() - stime) / len(requests)
+                outcome = max([classify(r, latency, limiter.base_latency) for r in responses] or [OK])
+                if len(responses) < len(requests): outcome = ERROR
+                limiter.release(outcome, latency)
+        for response in responses:
+            self.record_response(response)
+        return responses
 
-            if 'Content-Encoding' in headers and 'gzip' in headers['Content-Encoding']:
-                html = zlib.decompress(recv_data, 16 + zlib.MAX_WBITS)
+    def record_response(self, response):
+        """
+        记录目标是否有响应，连续无响应时熔断
+        :param response: 原始响应，失败为 None
+        """
+        if response is not None:
+            self.breaker.success()
+        elif self.breaker.failure():
+            if self.breaker.aborted:
+                Print_W(self.target + " 连续无响应，中止扫描")
             else:
-                html = recv_data
-
-            return status, html, headers
+                Print_W(self.target + " 连续无响应，暂停 %d 秒" % (self.breaker.open_until - time.time()))
 
-        except socket.error as e:
-            if e[0] in (10060, 'timed out') or str(e) == "[Errno 35] Resource temporarily unavailable":
-                return status, html, headers
-        except Exception, e:
-            return status, html, headers
+    def _request(self, requests):
+        """
+        发出请求并记录进行中的请求数与平均延迟
+        """
+        metrics.add_inflight(len(requests))
+        stime, received = time.time(), thread_received()
+        try:
+            responses = self._fetch(requests)
         finally:
-            if conn: conn.close()
+            metrics.add_inflight(-len(requests))
+            self.budget.charge(received=thread_received() - received)
+        latency = (time.time() - stime) / len(requests)
+        for response in responses:
+            if response is not None: metrics.latency(latency)
+        return responses
+
+    def _fetch(self, requests):
+        timeout = self.option.get("timeout")
+        requests = [(method, self.build_request(path, method)) for method, path in requests]
+        if self.pool is not None:
+            return self.pool.fetch(self.host, self.port, timeout, requests, self.peek, self.rtt)
+        responses = []
+        for method, raw in requests:
+            conn, response = HttpConnection(self.host, self.port, timeout, self.rtt), None
+            try:
+                if not conn.closed:
+                    conn.send(raw)
+                    response = conn.read_response(self.peek, method)[:3]
+            except (socket.error, socket.timeout):
+                pass
+            finally:
+                conn.close()
+            responses.append(response)
+        return responses
+
+    def need_body(self, response):
+        """
+        根据 HEAD 响应判断是否需要获取主体
+        :param response: HEAD 响应
+        :return:
+        """
+        if response is None: return False
+        status, html, headers = response
+        # 不支持 HEAD 的服务端
+        if status in ("400", "405", "501"): return True
+        if not status.startswith("2"): return False
+        if header_get(headers, "Content-Length") == "0": return False
+        return "text/html" not in (header_get(headers, "Content-Type") or "").lower()
+
+    def content_length(self, headers):
+        """
+        文件大小，分段响应取 Content-Range 中的总长度
+        :param headers:
+        :return:
+        """
+        content_range = header_get(headers, "Content-Range") or ""
+        if "/" in content_range and content_range.split("/")[-1].isdigit():
+            return content_range.split("/")[-1]
+        return headers.get("Content-Length", "0")
+
+    def decode(self, response):
+        """
+        解压响应主体，只解出前 peek 字节
+        :param response:
+        :return: status, html, headers
+        """
+        if response is None: return "", "", {}
+        status, html, headers = response
+        html = decode_body(html, header_get(headers, "Content-Encoding"), self.peek)
+        return status, html if html is not None else "", headers
+
+    def close(self):
+        """
+        释放连接与主机限速器
+        """
+        if self.pool is not None: self.pool.close()
+        if self.limiter is not None and not self.closed: controller.release(self.host)
+        self.closed = True
+
+
+class ScanBackup(TargetClient):
+    """
+    扫描备份
+    """
+
+    def __init__(self, target, option, config, calibrator=None):
+        """
+        :param calibrator: 预检阶段已完成校准的 Calibrator，None 时在此校准
+        """
+        TargetClient.__init__(self, target, option)
+        self.status = False
+        self.matchHandel = MatchHandel(config.get("rules"))
+        self.output_path = self.result_path(config.get("root"), target)
+        self.production = Production(self.host, config)
+        self.paths = self.production.getWorkPath()
+        if option.get("shard"):
+            index, total = option.get("shard")
+            self.paths = self.paths.shard(index, total)
+        self.done = self.journal.done_paths(target) if self.journal and option.get("resume") else set()
+        self.path_num = len(self.paths) - len(self.done)
+        self._Error_ = None
+        self.calibrator = calibrator
+        try:
+            self.getErr404Page(config)
+        except Exception:
+            self.close()
+            raise
+        # self.getNormalPage()
+
+    def getErr404Page(self, config):
+        """
+        获取错误页面关键字，按文件后缀和目录前缀分别校准，预检阶段已校准时直接使用
+        """
+        if self.calibrator is None:
+            self.calibrator = Calibrator(self, config)
+            self.calibrator.calibrate()
+        self.calibrator.scan = self
+        self._Error_ = self.calibrator.default
+
+    # def getNormalPage(self):
+    #     s, b, h = self.do_something("")
+    #     self.status = (s != "200" or s == "404")
+
+    @staticmethod
+    def result_path(root, target):
+        """
+        目标的 txt 结果文件，文件名不含目录：端口前的 : 换为 -，路径中的 / 与其他特殊字符换为 _
+        如 127.0.0.1:8080/sub/ 对应 127.0.0.1-8080_sub.txt
+        """
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", target.strip().strip("/").replace(":", "-"))
+        return root + "/" + (name or "_") + ".txt"
 
     def print_result(self, request, result):
+        self.handle_result(request.args[0], result, request.elapsed)
+
+    def print_results(self, request, results):
+        latency = request.elapsed / len(results) if request.elapsed and results else None
+        for path, result in zip(request.args[0], results):
+            self.handle_result(path, result, latency)
+
+    def handle_result(self, path, result, latency=None):
+        """
+        处理单个路径的响应，输出交给结果输出线程。达到预算上限后仍在进行中的请求的结果直接丢弃
+        :param path: 请求地址路径
+        :param result: status, html, headers
+        :param latency: 请求耗时
+        """
+        if self.over_budget(): return
         try:
-            url = self.main_path + urllib.quote(request.args[0]).replace("%5f", "/")
+            url = self.main_path + urllib.quote(path).replace("%5f", "/")
             status, body, headers = result
             self.path_num -= 1
-            _status, _body, _headers = self.match_error(result)
+            if self.budget.charge(requests=1): return
+            metrics.result(self.target, status)
+            if self.journal and status: self.journal.record(self.target, path)
+            _status, _body, _headers = self.match_error(result, path)
             if _status and _body and _headers:
-                Print_E_line(self.path_num, (result[0] or "404") + " " + self.target + url)
+                sink.progress(self.path_num, (result[0] or "404") + " " + self.target + url)
             else:
                 type_name = self.matchHandel.match(headers, body)
                 if type_name is not None:
-                    self.output_file.writelines(self.target + url + "\n")
-                    Print_(result[0] + " " + hexdump(body) + self.target + url + " Length: " + str(
-                        headers.get("Content-Length", "0")) + " Type: " + type_name)
+                    if self.budget.charge(findings=1): return
+                    length = self.content_length(headers)
+                    if self.journal:
+                        self.journal.finding(self.target, self.target + url, status, length, type_name)
+                    hit_model.record(self.production.features(path))
+                    record = {"target": self.target, "url": self.target + url, "status": status, "length": length,
+                              "type": type_name, "latency": round(latency, 3) if latency is not None else None}
+                    sink.hit(self.output_path, record, result[0] + " " + hexdump(body) + self.target + url +
+                             " Length: " + str(length) + " Type: " + type_name)
                 else:
-                    Print_E_line(self.path_num, (result[0] or "404") + " " + self.target + url)
+                    sink.progress(self.path_num, (result[0] or "404") + " " + self.target + url)
         except Exception, e:
             pass
+        finally:
+            self.over_budget()
+
+    def over_budget(self):
+        """
+        目标是否达到预算上限，首次达到时提示
+        """
+        if self.budget.check(): Print_W(self.target + " 预算用尽(%s)，停止扫描" % self.budget.spent)
+        return self.budget.spent is not None
 
-    def match_error(self, result):
+    def match_error(self, result, path=""):
         """
         匹配错误页面
         :param result:
+        :param path: 请求地址路径
         :return:
         """
-        status1, body1, headers1 = result
-        status2, body2, headers2 = self._Error_
-        _status, _body, _headers = [False] * 3
-        if status1 == status2: _status = True
-        if body1 == body2: _body = True
-        if headers1 == headers2: _headers = True
-        return _status, _body, _headers
+        return self.calibrator.match(result, path)
 
     def handle_exception(self, request, exc_info):
         """
@@ -190,64 +400,117 @@ class ScanBackup(object):
         Print_E("请求发生异常 #%s: %s" % (request.requestID, exc_info))
 
     def start(self):
-        main = ThreadPool(self.option.get("thread"))
+        if self.option.get("engine") == "event":
+            self.start_event()
+        else:
+            self.start_thread()
+        self.finish()
+
+    def finish(self):
+        """
+        结束扫描，全部路径完成或达到预算上限时在日志中标记目标完成
+        """
+        if self.journal and (self.path_num <= 0 or self.budget.spent): self.journal.finish_target(self.target)
+        metrics.target_end(self.target)
+        self.close()
 
-        for req in self.requests:
-            main.putRequest(req)
+    def iter_paths(self):
+        """
+        待扫描路径，断点续扫时跳过已完成的路径，目标熔断中止、达到预算上限或收到停止请求后结束
+        """
+        metrics.target_start(self.target, self.path_num)
+        self.budget.start()
+        for path in self.paths:
+            if shutdown.is_set() or self.breaker.aborted or self.over_budget(): return
+            if path not in self.done:
+                yield path
+
+    def start_thread(self):
+        """
+        线程池扫描：请求队列有界，结果到达即处理，队列腾出空位时再从字典补充
+        """
+        thread = self.option.get("thread")
+        main = ThreadPool(thread, q_size=thread * 4)
+        requests = self.iter_requests()
+        exhausted = False
 
         while not self.status:
             try:
-                time.sleep(0.5)
-                main.poll()
+                # 目标熔断中止或达到预算上限后不再等待排队中的请求
+                if self.breaker.aborted or self.over_budget(): main.cancel(self)
+                if not exhausted: exhausted = not main.fill(requests)
+                # 有结果时立即返回，全部完成时抛出 NoResultsPending
+                main.poll(timeout=0.5)
 
             except NoResultsPending:
+                # 队列在两次补充之间处理完，字典未生成完时继续
+                if not exhausted: continue
                 print "\n"
                 Print_B("**** 扫描结束无结果!")
                 break
             except KeyboardInterrupt:
-                print "\n"
-                print "1: 结束任务"
-                print "2: 进入下一任务"
-                print "3: 继续当前任务\n"
-                i = raw_input("请输入下一步编号 > ")
-                workNum = len(main.workers)
-                if i.strip() == "1":
-                    main.dismissWorkers(workNum)
+                i = self.interrupt()
+                if i == "1":
                     self.status = True
                     break
                 elif i == "2":
-                    # main.dismissWorkers(workNum)
                     break
                 elif i == "3":
                     continue
 
-        if main.dismissedWorkers:
-            print "\n"
-            Print_B(self.target + " 扫描结束，退出工作线程...")
-            main.joinAllDismissedWorkers()
+        # 中断时丢弃本目标排队中的请求，工作线程完成当前请求后退出
+        main.cancel(self)
+        main.dismissWorkers(len(main.workers))
+        main.joinAllDismissedWorkers()
 
-        self.output_file.close()
+    def iter_requests(self):
+        """
+        从字典流式生成 WorkRequest
+        """
+        depth = int(self.option.get("pipeline") or 1)
+        if self.pool is not None and depth > 1:
+            paths = self.iter_paths()
+            while True:
+                batch = list(itertools.islice(paths, depth))
+                if not batch: break
+                yield WorkRequest(self.do_pipeline, [batch], None, callback=self.print_results,
+                                  exc_callback=self.handle_exception, group=self)
+        else:
+            for path in self.iter_paths():
+                yield WorkRequest(self.do_something, [path], None, callback=self.print_result,
+                                  exc_callback=self.handle_exception, group=self)
 
-    def sockHttp(self, host, port, timeout=3):
+    def start_event(self):
         """
-        Sock Https 请调用后调用结束
-        :param host:
-        :param port:
-        :param timeout:
-        :return:
+        事件循环扫描
         """
-        socketObj = socket(AF_INET, SOCK_STREAM)
-        try:
-            if port == 443:
-                if not _https:
-                    raise Exception("Not support SSL")
-                try:
-                    socketObj = ssl.wrap_socket(socketObj, ssl_version=ssl.PROTOCOL_TLSv1)
-                except ssl.SSLError:
-                    socketObj = ssl.wrap_socket(socketObj, ssl_version=ssl.PROTOL_SSLv23)
-
-            socketObj.settimeout(timeout)
-            socketObj.connect((host, int(port)))
-            return socketObj
-        except IOError, e:
-            return None
+        engine = EventEngine(int(self.option.get("concurrency") or 1000), self.option.get("thread"),
+                             int(self.option.get("pipeline") or 1))
+        engine.add(self)
+
+        while not self.status:
+            try:
+                engine.run()
+                print "\n"
+                Print_B("**** 扫描结束无结果!")
+                break
+            except KeyboardInterrupt:
+                i = self.interrupt()
+                if i == "1":
+                    self.status = True
+                    break
+                elif i == "2":
+                    break
+                elif i == "3":
+                    continue
+
+    def interrupt(self):
+        """
+        Ctrl-C 菜单
+        :return: 选择的编号
+        """
+        print "\n"
+        print "1: 结束任务"
+        print "2: 进入下一任务"
+        print "3: 继续当前任务\n"
+        return raw_input("请输入下一步编号 > ").strip()
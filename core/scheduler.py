@@ -0,0 +1,303 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: scheduler.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/4 : 上午11:20
+import time
+from collections import deque
+
+from AnsiColor import *
+from threadpool import *
+from scanwork import ScanBackup, Deferred, shutdown
+from resolver import resolver
+from preflight import check_target, Unreachable
+from eventloop import EventEngine
+
+
+class TargetState(object):
+    """
+    调度中的单个目标
+    """
+
+    def __init__(self, target_id, scan):
+        self.id = target_id
+        self.scan = scan
+        self.paths = scan.iter_paths()
+        # 未放行而退回的路径，优先分发
+        self.retry = deque()
+        self.inflight = 0
+        self.exhausted = False
+
+    def take(self, num):
+        """
+        取出至多 num 个路径
+        """
+        paths = []
+        while self.retry and len(paths) < num:
+            paths.append(self.retry.popleft())
+        while not self.exhausted and len(paths) < num:
+            try:
+                paths.append(self.paths.next())
+            except StopIteration:
+                self.exhausted = True
+        return paths
+
+    def skip(self):
+        self.paths = iter([])
+        self.retry.clear()
+        self.exhausted = True
+
+    def done(self):
+        return self.exhausted and not self.retry and not self.inflight
+
+
+class Scheduler(object):
+    """
+    多目标调度，同时保持多个目标活跃并交替分发其路径，目标逐个从目标流中读取
+    """
+
+    def __init__(self, option, config):
+        self.option = option
+        self.config = config
+        self.targets = iter(option.get("targets"))
+        self.targets_done = False
+        self.count = 0
+        self.thread = int(option.get("thread"))
+        self.active_max = int(option.get("active") or 10)
+        # 共享线程池中单个主机默认最多占用一半工作线程，主机无响应时其他目标仍可扫描
+        self.host_cap = int(option.get("hostcap") or max(1, self.thread // 2))
+        self.global_cap = self.thread * 2
+        self.depth = int(option.get("pipeline") or 1)
+        self.active = []
+        self.setting_up = 0
+        self.inflight = 0
+        self.host_inflight = {}
+        self.status = False
+        self.journal = option.get("journal")
+
+    def _next_target(self):
+        if shutdown.is_set():
+            self.targets_done = True
+            return None
+        try:
+            target_info = self.targets.next()
+        except StopIteration:
+            self.targets_done = True
+            return None
+        self.count += 1
+        return target_info
+
+    def _setup(self, target):
+        """
+        目标初始化：解析域名、检查可连接性后生成字典并校准错误页面
+        :raise Unreachable: 目标无法解析或无法连接
+        """
+        if resolver.resolve(ScanBackup.host_parse(target)[0]) is None: raise Unreachable("域名解析失败")
+        if not check_target(target, self.option): raise Unreachable("目标无法连接")
+        return ScanBackup(target, self.option, self.config)
+
+    def _setup_done(self, request, scan):
+        self.setting_up -= 1
+        target_id = request.target_id
+        Print("TaskID <" + str(target_id) + "> TaskUrl <" + scan.target + "> WorkNum <" + str(scan.path_num) + ">")
+        self.active.append(TargetState(target_id, scan))
+
+    def _setup_error(self, request, exc_info):
+        self.setting_up -= 1
+        if isinstance(exc_info[1], Unreachable):
+            Print_W("%s，跳过目标 <%s>" % (exc_info[1], request.args[0]))
+            return
+        Print_E("目标初始化失败 <%s>: %s" % (request.args[0], exc_info[1]))
+
+    def _start_setups(self, submit, running):
+        """
+        补足活跃目标，目标初始化(域名解析、可连接性检查、字典生成、404 页面获取)在工作线程中进行
+        :param submit: 提交 WorkRequest 的方法
+        :param running: 正在扫描的目标数
+        """
+        while not self.targets_done and running + self.setting_up < self.active_max:
+            target_info = self._next_target()
+            if target_info is None: break
+            if self.journal and self.option.get("resume") and self.journal.target_done(target_info.get("target").strip()): continue
+            req = WorkRequest(self._setup, [target_info.get("target").strip()], None, callback=self._setup_done,
+                              exc_callback=self._setup_error)
+            req.target_id = target_info.get("id")
+            self.setting_up += 1
+            submit(req)
+
+    def _dispatch(self, main):
+        """
+        轮询各活跃目标分发路径，受单主机(含自适应窗口)与全局并发限制
+        """
+        # 中止或达到预算上限的目标先丢弃排队中的请求，不等待主机或全局并发名额
+        for state in self.active:
+            if state.scan.breaker.aborted or state.scan.over_budget(): self._cancel(main, state)
+        progress = True
+        while progress and self.inflight < self.global_cap:
+            progress = False
+            for state in self.active:
+                if self.inflight >= self.global_cap: break
+                host, limiter = state.scan.host, state.scan.limiter
+                cap = min(self.host_cap, limiter.limit()) if limiter else self.host_cap
+                if self.host_inflight.get(host, 0) >= cap: continue
+                # 主机处于退避间隔内或目标熔断暂停时不占用工作线程
+                if limiter and not limiter.ready(): continue
+                if not state.scan.breaker.ready(): continue
+                # 只有连接池可用时才按流水线深度成批取出
+                pipelined = self.depth > 1 and state.scan.pool is not None
+                paths = state.take(self.depth if pipelined else 1)
+                if not paths: continue
+                # 工作线程不等待熔断与限速，未放行时路径退回目标
+                if pipelined:
+                    req = WorkRequest(state.scan.do_pipeline, [paths], {"block": False}, callback=self._result,
+                                      exc_callback=self._result_error, group=state.scan)
+                else:
+                    req = WorkRequest(state.scan.do_something, paths, {"block": False}, callback=self._result,
+                                      exc_callback=self._result_error, group=state.scan)
+                req.state = state
+                state.inflight += 1
+                self.inflight += 1
+                self.host_inflight[host] = self.host_inflight.get(host, 0) + 1
+                main.putRequest(req)
+                progress = True
+
+    def _cancel(self, main, state):
+        """
+        跳过目标，丢弃其排队中的请求，正在执行的请求完成后目标结束
+        """
+        state.skip()
+        for request in main.cancel(state.scan):
+            self._release(request)
+
+    def _release(self, request):
+        state = request.state
+        state.inflight -= 1
+        self.inflight -= 1
+        self.host_inflight[state.scan.host] -= 1
+        if not self.host_inflight[state.scan.host]: del self.host_inflight[state.scan.host]
+
+    def _result(self, request, result):
+        self._release(request)
+        scan = request.state.scan
+        if isinstance(request.args[0], list):
+            scan.print_results(request, result)
+        else:
+            scan.print_result(request, result)
+
+    def _result_error(self, request, exc_info):
+        self._release(request)
+        if isinstance(exc_info[1], Deferred):
+            paths = request.args[0]
+            request.state.retry.extend(paths if isinstance(paths, list) else [paths])
+            return
+        request.state.scan.handle_exception(request, exc_info)
+
+    def _reap(self):
+        """
+        结束已完成的目标
+        """
+        for state in [s for s in self.active if s.done()]:
+            self.active.remove(state)
+            state.scan.finish()
+            Print_B("TaskID <" + str(state.id) + "> " + state.scan.target + " 扫描结束")
+
+    def _idle(self):
+        """
+        没有进行中的请求且各目标都处于熔断暂停或主机退避间隔内时，等待到最早可以分发的时间
+        """
+        wake = []
+        for state in self.active:
+            if state.exhausted and not state.retry: continue
+            breaker, limiter = state.scan.breaker, state.scan.limiter
+            until = breaker.open_until if breaker.state == breaker.OPEN else 0.0
+            if limiter: until = max(until, limiter.next_time)
+            wake.append(until)
+        if wake: time.sleep(min(1.0, max(0.0, min(wake) - time.time())))
+
+    def _pending(self):
+        return not self.targets_done or self.active or self.setting_up
+
+    def interrupt(self):
+        """
+        Ctrl-C 菜单
+        :return: 选择的编号
+        """
+        print "\n"
+        print "1: 结束任务"
+        print "2: 跳过当前活跃任务"
+        print "3: 继续当前任务\n"
+        i = raw_input("请输入下一步编号 > ").strip()
+        if i == "1":
+            self.status = True
+            self.targets_done = True
+        return i
+
+    def run(self):
+        """
+        :return: 是否选择了结束任务
+        """
+        if self.option.get("engine") == "event":
+            self.run_event()
+        else:
+            self.run_thread()
+        return self.status
+
+    def run_thread(self):
+        """
+        共享线程池调度
+        """
+        main = ThreadPool(self.thread)
+        while self._pending():
+            try:
+                self._start_setups(main.putRequest, len(self.active))
+                self._dispatch(main)
+                main.poll(timeout=0.05)
+                self._reap()
+            except NoResultsPending:
+                self._reap()
+                self._idle()
+            except KeyboardInterrupt:
+                if self.interrupt() in ("1", "2"):
+                    for state in self.active: self._cancel(main, state)
+
+        main.dismissWorkers(len(main.workers))
+        print "\n"
+        Print_B("**** 全部目标扫描结束，退出工作线程...")
+        main.joinAllDismissedWorkers()
+
+    def run_event(self):
+        """
+        事件引擎调度，目标初始化在少量线程中进行
+        """
+        setup = ThreadPool(min(self.thread, self.active_max))
+        # 事件引擎不占用工作线程，单主机上限默认为线程数
+        engine = EventEngine(int(self.option.get("concurrency") or 1000),
+                             int(self.option.get("hostcap") or self.thread), self.depth)
+
+        def feed():
+            try:
+                setup.poll()
+            except NoResultsPending:
+                pass
+            for state in self.active:
+                engine.add(state.scan)
+            self.active = []
+            self._start_setups(setup.putRequest, len(engine.tasks))
+            return not self.targets_done or self.setting_up
+
+        while True:
+            try:
+                engine.run(feed, self._finish_scan)
+                break
+            except KeyboardInterrupt:
+                if self.interrupt() in ("1", "2"):
+                    for task in engine.tasks: task.skip()
+
+        setup.dismissWorkers(len(setup.workers))
+        print "\n"
+        Print_B("**** 全部目标扫描结束...")
+
+    def _finish_scan(self, scan):
+        scan.finish()
+        Print_B(scan.target + " 扫描结束")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: sink.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/18 : 上午10:05
+import os
+import sys
+import csv
+import json
+import time
+import Queue
+import threading
+from collections import OrderedDict
+
+from AnsiColor import Print_, Print_E_line, Print_W, ansi
+
+# 队列消息类型
+_PROGRESS, _HIT, _STOP = range(3)
+
+
+class ResultSink(object):
+    """
+    结果输出线程：命中批量写入各目标的 txt 与结构化结果文件(JSONL/CSV)，
+    进度每批只显示最后一条，安静模式下按固定频率刷新汇总进度
+    """
+    FIELDS = ("target", "url", "status", "length", "type", "latency")
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.output = None
+        self.writer = None
+        self.quiet = False
+        self.interval = 0.5
+        self.count = 0
+        self.hits = 0
+        self.started = time.time()
+        self.refreshed = 0
+        self.remote = None
+        self.remote_progress = True
+        self.lock = threading.Lock()
+
+    def start(self, output=None, quiet=False, interval=0.5):
+        """
+        启动输出线程
+        :param output: 结构化结果文件，.csv 结尾时为 CSV，否则为 JSONL
+        :param quiet: 安静模式，不逐条显示进度
+        :param interval: 安静模式的刷新间隔
+        """
+        if output:
+            exists = os.path.exists(output) and os.path.getsize(output) > 0
+            self.output = open(output, "ab")
+            if output.lower().endswith(".csv"):
+                self.writer = csv.writer(self.output)
+                if not exists: self.writer.writerow(self.FIELDS)
+        self.quiet = quiet
+        self.interval = interval
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def progress(self, num, line):
+        """
+        未命中的路径
+        :param num: 目标剩余路径数
+        :param line: 进度行
+        """
+        self._put((_PROGRESS, num, line))
+
+    def hit(self, txt_path, record, line):
+        """
+        命中的路径
+        :param txt_path: 目标的 txt 结果文件
+        :param record: 结构化结果，键为 FIELDS
+        :param line: 终端显示内容
+        """
+        self._put((_HIT, txt_path, record, line))
+
+    def forward(self, queue, progress=True):
+        """
+        将结果转发给父进程或协调节点输出
+        :param queue: 有 put 方法的队列
+        :param progress: 是否转发进度
+        """
+        self.remote = queue
+        self.remote_progress = progress
+
+    def put(self, item):
+        """
+        加入子进程转发的结果
+        """
+        self._put(item)
+
+    def _put(self, item):
+        if self.remote is not None:
+            if item[0] != _PROGRESS or self.remote_progress: self.remote.put(("sink", item))
+        elif self.thread is None:
+            # 未启动输出线程时同步输出
+            with self.lock:
+                self._write([item])
+        else:
+            self.queue.put(item)
+
+    def _run(self):
+        while True:
+            try:
+                items = [self.queue.get(True, self.interval)]
+            except Queue.Empty:
+                items = []
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            self._write(items)
+            if self.quiet and time.time() - self.refreshed >= self.interval: self._refresh()
+            if any(item[0] == _STOP for item in items): break
+
+    def _write(self, items):
+        last, files = None, {}
+        for item in items:
+            if item[0] == _PROGRESS:
+                self.count += 1
+                last = item
+            elif item[0] == _HIT:
+                kind, txt_path, record, line = item
+                self.count += 1
+                self.hits += 1
+                files.setdefault(txt_path, []).append(record["url"] + "\n")
+                Print_(line)
+                last = None
+                if self.output is None: continue
+                # 写入失败只影响本条结果，输出线程继续运行
+                try:
+                    if self.writer is not None:
+                        self.writer.writerow([record.get(k) for k in self.FIELDS])
+                    else:
+                        self.output.write(json.dumps(OrderedDict((k, record.get(k)) for k in self.FIELDS)) + "\n")
+                except (IOError, OSError, ValueError), e:
+                    Print_W("结果写入失败 <%s>: %s" % (record.get("url"), e))
+        for txt_path, lines in files.items():
+            try:
+                with open(txt_path, "a") as f:
+                    f.writelines(lines)
+            except (IOError, OSError), e:
+                Print_W("结果写入失败 <%s>: %s" % (txt_path, e))
+        if self.output is not None and files:
+            try:
+                self.output.flush()
+            except (IOError, OSError), e:
+                Print_W("结果写入失败: %s" % e)
+        if last is not None and not self.quiet:
+            Print_E_line(last[1], last[2])
+            sys.stdout.flush()
+
+    def _refresh(self):
+        self.refreshed = time.time()
+        rate = self.count / max(0.001, self.refreshed - self.started)
+        sys.stdout.write("\r" + ansi.warning("[ %d ] %.0f req/s  hits: %d" % (self.count, rate, self.hits)))
+        sys.stdout.flush()
+
+    def close(self):
+        """
+        写出剩余结果并结束输出线程
+        """
+        if self.thread is not None:
+            self.queue.put((_STOP,))
+            self.thread.join()
+            self.thread = None
+            if self.quiet: print
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+
+sink = ResultSink()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: targets.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/21 : 上午10:05
+import re
+import sys
+import math
+import struct
+import hashlib
+import itertools
+
+# 默认端口不写入规范化后的目标
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+_HOST = re.compile(r"^[a-z0-9_.\-]+$")
+
+
+def target_id(target):
+    """
+    由目标生成固定的任务编号，便于多次运行之间对应，
+    取 sha1 前 16 位十六进制，大规模目标列表中也不会碰撞
+    """
+    return hashlib.sha1(target.strip()).hexdigest()[:16]
+
+
+def normalize(target):
+    """
+    目标规范化：主机小写，去掉协议、用户信息、默认端口、查询串与锚点，目录以 / 结尾，
+    https 目标使用 443 端口
+    :param target: 文件中的一行或命令行中的一个目标
+    :return: "host[:port][/path/]"，无效目标返回 None
+    """
+    target = target.strip()
+    if not target or target.startswith("#"): return None
+    scheme = "http"
+    if "://" in target:
+        scheme, target = target.split("://", 1)
+        scheme = scheme.lower()
+        if scheme not in DEFAULT_PORTS: return None
+    target = re.split(r"[?#]", target, 1)[0]
+    netloc, slash, path = target.partition("/")
+    netloc = netloc.rsplit("@", 1)[-1].lower()
+    host, colon, port = netloc.partition(":")
+    host = host.rstrip(".")
+    port = port or DEFAULT_PORTS[scheme]
+    if not _HOST.match(host) or not port.isdigit() or not 0 < int(port) < 65536: return None
+    port = str(int(port))
+    path = "/".join(p for p in path.split("/") if p)
+    target = host if port == "80" else "%s:%s" % (host, port)
+    return target + "/" + path + "/" if path else target
+
+
+class BloomFilter(object):
+    """
+    布隆过滤器，按容量与误判率确定位数组大小
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) * math.log(2))))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # 增强双重哈希由一次 md5 得到 k 个位置，位数组较小时普通双重哈希的误判率明显偏高
+        a, b = struct.unpack("<QQ", hashlib.md5(key).digest())
+        bits = self.bits
+        x, y, positions = a % bits, b % bits, []
+        for i in xrange(self.hashes):
+            positions.append(x)
+            x = (x + y) % bits
+            y = (y + i) % bits
+        return positions
+
+    def __contains__(self, key):
+        return all(self.array[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        """
+        :return: 是否为新元素
+        """
+        new, array = False, self.array
+        for p in self._positions(key):
+            if not array[p >> 3] & (1 << (p & 7)):
+                array[p >> 3] |= 1 << (p & 7)
+                new = True
+        if new: self.count += 1
+        return new
+
+
+class ScalableBloomFilter(object):
+    """
+    可扩展的布隆过滤器：当前过滤器满后追加容量翻四倍、误判率减半的过滤器，
+    总误判率不超过 error_rate，内存随元素数量线性增长(约 4 字节/元素)
+    """
+
+    def __init__(self, capacity=1000000, error_rate=1e-6):
+        self.filters = [BloomFilter(capacity, error_rate / 2)]
+
+    def __contains__(self, key):
+        return any(key in f for f in self.filters)
+
+    def add(self, key):
+        """
+        :return: 是否为新元素
+        """
+        last = self.filters[-1]
+        if any(key in f for f in self.filters[:-1]): return False
+        if last.count >= last.capacity:
+            if key in last: return False
+            last = BloomFilter(last.capacity * 4, last.error_rate / 2)
+            self.filters.append(last)
+        return last.add(key)
+
+
+def iter_targets(lines):
+    """
+    流式读取目标，规范化并去重
+    :param lines: 可迭代的目标行，文件、标准输入或列表
+    :return: {"id": , "target": } 生成器
+    """
+    seen = ScalableBloomFilter()
+    for line in lines:
+        target = normalize(line)
+        if target is None or not seen.add(target): continue
+        yield {"id": target_id(target), "target": target}
+
+
+def open_targets(source):
+    """
+    目标来源：- 为标准输入，.txt 为文件(逐行读取)，否则为逗号分隔的目标
+    :return: 可迭代的目标行
+    :raise IOError: 文件无法打开
+    """
+    if source == "-":
+        return sys.stdin
+    if source.find(".txt") > -1 and source.find("://") == -1:
+        return open(source)
+    return source.split(",")
+
+
+def chunks(targets, size):
+    """
+    按 size 个目标分组，供解析、预检与扫描逐组进行
+    """
+    targets = iter(targets)
+    while True:
+        chunk = list(itertools.islice(targets, size))
+        if not chunk: return
+        yield chunk
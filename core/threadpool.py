@@ -37,6 +37,7 @@ __all__ = [
     'makeRequests',
     'NoResultsPending',
     'NoWorkersAvailable',
+    'RequestQueue',
     'ThreadPool',
     'WorkRequest',
     'WorkerThread'
@@ -48,8 +49,10 @@ __license__ = "MIT license"
 
 # standard library modules
 import sys
+import time
 import threading
 import traceback
+from collections import deque
 
 try:
     import Queue  # Python 2
@@ -110,6 +113,80 @@ def makeRequests(callable_, args_list, callback=None,
 
 
 # classes
+class RequestQueue(object):
+    """FIFO queue of work requests shared by the worker threads.
+
+    Unlike ``Queue.Queue``, waiting workers are woken up as soon as they are
+    dismissed, and requests still waiting in the queue can be removed again
+    (see ``ThreadPool.cancel``).
+
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._cond = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        return len(self._items)
+
+    def full(self):
+        return 0 < self.maxsize <= len(self._items)
+
+    def put(self, request, block=True, timeout=None):
+        """Put a request into the queue, waiting for a free slot if the
+        queue is bounded.
+
+        Raises ``Queue.Full`` if no slot became free within ``timeout``
+        seconds, or at once if ``block`` is false.
+
+        """
+        with self._cond:
+            if self.full():
+                if not block:
+                    raise Queue.Full
+                deadline = None if timeout is None else time.time() + timeout
+                while self.full():
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise Queue.Full
+                    self._cond.wait(remaining)
+            self._items.append(request)
+            self._cond.notify_all()
+
+    def get(self, dismissed):
+        """Wait for the next request.
+
+        Returns ``None`` once the ``dismissed`` event of the calling worker is
+        set (see ``wake``).
+
+        """
+        with self._cond:
+            while not self._items and not dismissed.isSet():
+                self._cond.wait()
+            if dismissed.isSet():
+                return None
+            request = self._items.popleft()
+            # wake up producers blocked on a full queue
+            self._cond.notify_all()
+            return request
+
+    def remove(self, predicate):
+        """Remove and return all queued requests for which ``predicate``
+        returns true."""
+        with self._cond:
+            removed = [r for r in self._items if predicate(r)]
+            if removed:
+                self._items = deque(r for r in self._items if not predicate(r))
+                self._cond.notify_all()
+            return removed
+
+    def wake(self):
+        """Wake up all waiting threads, e.g. after workers were dismissed."""
+        with self._cond:
+            self._cond.notify_all()
+
+
 class WorkerThread(threading.Thread):
     """Background thread connected to the requests/results queues.
 
@@ -118,10 +195,10 @@ class WorkerThread(threading.Thread):
 
     """
 
-    def __init__(self, requests_queue, results_queue, poll_timeout=5, **kwds):
+    def __init__(self, requests_queue, results_queue, **kwds):
         """Set up thread in daemonic mode and start it immediatedly.
 
-        ``requests_queue`` and ``results_queue`` are instances of
+        ``requests_queue`` is the ``RequestQueue`` and ``results_queue`` the
         ``Queue.Queue`` passed by the ``ThreadPool`` class when it creates a
         new worker thread.
 
@@ -130,37 +207,31 @@ class WorkerThread(threading.Thread):
         self.setDaemon(True)
         self._requests_queue = requests_queue
         self._results_queue = results_queue
-        self._poll_timeout = poll_timeout
         self._dismissed = threading.Event()
         self.start()
 
     def run(self):
         """Repeatedly process the job queue until told to exit."""
         while True:
-            if self._dismissed.isSet():
-                # we are dismissed, break out of loop
+            # blocks without polling, returns None when we are dismissed
+            request = self._requests_queue.get(self._dismissed)
+            if request is None:
                 break
-            # get next work request. If we don't get a new request from the
-            # queue after self._poll_timout seconds, we jump to the start of
-            # the while loop again, to give the thread a chance to exit.
+            start = time.time()
             try:
-                request = self._requests_queue.get(True, self._poll_timeout)
-            except Queue.Empty:
-                continue
-            else:
-                if self._dismissed.isSet():
-                    # we are dismissed, put back request in queue and exit loop
-                    self._requests_queue.put(request)
-                    break
-                try:
-                    result = request.callable(*request.args, **request.kwds)
-                    self._results_queue.put((request, result))
-                except:
-                    request.exception = True
-                    self._results_queue.put((request, sys.exc_info()))
+                result = request.callable(*request.args, **request.kwds)
+                request.elapsed = time.time() - start
+                self._results_queue.put((request, result))
+            except:
+                request.exception = True
+                request.elapsed = time.time() - start
+                self._results_queue.put((request, sys.exc_info()))
 
     def dismiss(self):
         """Sets a flag to tell the thread to exit when done with current job.
+
+        Call ``RequestQueue.wake`` afterwards to wake up an idle thread.
+
         """
         self._dismissed.set()
 
@@ -175,7 +246,7 @@ class WorkRequest(object):
     """
 
     def __init__(self, callable_, args=None, kwds=None, requestID=None,
-                 callback=None, exc_callback=_handle_thread_exception):
+                 callback=None, exc_callback=_handle_thread_exception, group=None):
         """Create a work request for a callable and attach callbacks.
 
         A work request consists of the a callable to be executed by a
@@ -200,6 +271,10 @@ class WorkRequest(object):
         ``ThreadPool`` object to store the results of that work request in a
         dictionary. It defaults to the return value of ``id(self)``.
 
+        ``group`` tags the request, e.g. with the target it belongs to, so
+        that queued requests of that group can be dropped with
+        ``ThreadPool.cancel``.
+
         """
         if requestID is None:
             self.requestID = id(self)
@@ -209,8 +284,11 @@ class WorkRequest(object):
             except TypeError:
                 raise TypeError("requestID must be hashable.")
         self.exception = False
+        # seconds the callable ran, set by the worker thread
+        self.elapsed = None
         self.callback = callback
         self.exc_callback = exc_callback
+        self.group = group
         self.callable = callable_
         self.args = args or []
         self.kwds = kwds or {}
@@ -227,7 +305,7 @@ class ThreadPool(object):
 
     """
 
-    def __init__(self, num_workers, q_size=0, resq_size=0, poll_timeout=5):
+    def __init__(self, num_workers, q_size=0, resq_size=0):
         """Set up the thread core and start num_workers worker threads.
 
         ``num_workers`` is the number of worker threads to start initially.
@@ -235,7 +313,8 @@ class ThreadPool(object):
         If ``q_size > 0`` the size of the work *request queue* is limited and
         the thread core blocks when the queue is full and it tries to put
         more work requests in it (see ``putRequest`` method), unless you also
-        use a positive ``timeout`` value for ``putRequest``.
+        use a positive ``timeout`` value for ``putRequest``. ``fill`` puts
+        requests from an iterator only while there is room.
 
         If ``resq_size > 0`` the size of the *results queue* is limited and the
         worker threads will block when the queue is full and they try to put
@@ -249,32 +328,31 @@ class ThreadPool(object):
             ``ThreadPool.putRequest()`` and catch ``Queue.Full`` exceptions.
 
         """
-        self._requests_queue = Queue.Queue(q_size)
+        self._requests_queue = RequestQueue(q_size)
         self._results_queue = Queue.Queue(resq_size)
         self.workers = []
         self.dismissedWorkers = []
         self.workRequests = {}
-        self.createWorkers(num_workers, poll_timeout)
+        self.createWorkers(num_workers)
 
-    def createWorkers(self, num_workers, poll_timeout=5):
-        """Add num_workers worker threads to the core.
-
-        ``poll_timout`` sets the interval in seconds (int or float) for how
-        ofte threads should check whether they are dismissed, while waiting for
-        requests.
-
-        """
+    def createWorkers(self, num_workers):
+        """Add num_workers worker threads to the core."""
         for i in range(num_workers):
             self.workers.append(WorkerThread(self._requests_queue,
-                                             self._results_queue, poll_timeout=poll_timeout))
+                                             self._results_queue))
 
     def dismissWorkers(self, num_workers, do_join=False):
-        """Tell num_workers worker threads to quit after their current task."""
+        """Tell num_workers worker threads to quit after their current task.
+
+        Idle workers exit immediately.
+
+        """
         dismiss_list = []
         for i in range(min(num_workers, len(self.workers))):
             worker = self.workers.pop()
             worker.dismiss()
             dismiss_list.append(worker)
+        self._requests_queue.wake()
 
         if do_join:
             for worker in dismiss_list:
@@ -297,8 +375,47 @@ class ThreadPool(object):
         self._requests_queue.put(request, block, timeout)
         self.workRequests[request.requestID] = request
 
-    def poll(self, block=False):
-        """Process any new results in the queue."""
+    def fill(self, requests):
+        """Put requests from the iterator ``requests`` while the bounded
+        request queue has room.
+
+        Returns ``False`` once the iterator is exhausted. This gives
+        backpressure without blocking the caller: results are consumed with
+        ``poll`` and the queue is filled again as workers pick up requests.
+
+        """
+        while not self._requests_queue.full():
+            try:
+                request = next(requests)
+            except StopIteration:
+                return False
+            self.putRequest(request)
+        return True
+
+    def cancel(self, group=None):
+        """Drop the requests of ``group`` that have not been picked up by a
+        worker yet, or all queued requests if ``group`` is ``None``.
+
+        Requests already running are not interrupted, their results still
+        arrive through ``poll``. Returns the dropped requests, their callbacks
+        are not called.
+
+        """
+        removed = self._requests_queue.remove(
+            lambda request: group is None or request.group is group)
+        for request in removed:
+            self.workRequests.pop(request.requestID, None)
+        return removed
+
+    def poll(self, block=False, timeout=None):
+        """Process any new results in the queue.
+
+        If ``timeout`` is given, wait at most ``timeout`` seconds for the first
+        result, then process the results already queued without blocking.
+        Raises ``NoResultsPending`` as soon as all requests are done, so a
+        caller waiting with a timeout returns on completion, not on expiry.
+
+        """
         while True:
             # still results pending?
             if not self.workRequests:
@@ -308,7 +425,11 @@ class ThreadPool(object):
                 raise NoWorkersAvailable
             try:
                 # get back next results
-                request, result = self._results_queue.get(block=block)
+                if timeout is not None:
+                    request, result = self._results_queue.get(True, timeout)
+                    timeout = None
+                else:
+                    request, result = self._results_queue.get(block=block)
                 # has an exception occured?
                 if request.exception and request.exc_callback:
                     request.exc_callback(request, result)
@@ -334,7 +455,6 @@ class ThreadPool(object):
 
 if __name__ == '__main__':
     import random
-    import time
 
     # 线程必须要做的工作（在我们的例子中是微不足道的）
     def do_something(data):
@@ -395,8 +515,8 @@ if __name__ == '__main__':
     i = 0
     while True:
         try:
-            time.sleep(0.5)
-            main.poll()
+            # 最多等待 0.5 秒，有结果时立即返回
+            main.poll(timeout=0.5)
             print("主线程工作...")
             print("(活跃的工作线程: %i)" % (threading.activeCount() - 1,))
             if i == 10:
@@ -0,0 +1,190 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+# Author: ver007
+# Description: wordlist.py python2.7
+# License: Apache Licence
+# CreateTime: 2018/7/10 : 下午4:15
+import bisect
+import heapq
+
+
+def unique(items):
+    """
+    去重并保持顺序
+    """
+    seen, result = set(), []
+    for item in items:
+        if item in seen: continue
+        seen.add(item)
+        result.append(item)
+    return result
+
+
+class Product(object):
+    """
+    前缀 × 主干 × 后缀 的笛卡尔积，不展开存储。
+    给出各因子的权重时按权重积从大到小遍历，下标顺序不变
+    """
+
+    def __init__(self, prefixes, stems, suffixes, weights=None):
+        self.prefixes = list(prefixes)
+        self.stems = list(stems)
+        self.suffixes = list(suffixes)
+        self.inner = len(self.stems) * len(self.suffixes)
+        # (前缀权重, 主干权重, 后缀权重)，与各因子一一对应
+        self.weights = weights
+        self._stems = None
+
+    def __len__(self):
+        return len(self.prefixes) * self.inner
+
+    def __getitem__(self, index):
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError(index)
+        p, rest = divmod(index, self.inner)
+        s, f = divmod(rest, len(self.suffixes))
+        return self.prefixes[p] + self.stems[s] + self.suffixes[f]
+
+    def __iter__(self):
+        if self.weights:
+            for score, index, path in self.ranked():
+                yield path
+            return
+        for prefix in self.prefixes:
+            for stem in self.stems:
+                for suffix in self.suffixes:
+                    yield prefix + stem + suffix
+
+    def ranked(self, offset=0):
+        """
+        按权重积从大到小遍历，积相同时按下标。各因子按权重降序排列后，
+        每个组合只由唯一的前驱入堆，堆的大小与已遍历的数量无关
+        :param offset: 下标偏移
+        :return: (-权重积, 下标, 路径) 生成器
+        """
+        if not len(self): return
+        orders = [sorted(xrange(len(w)), key=lambda i, w=w: -w[i]) for w in self.weights]
+        (po, so, fo), (pw, sw, fw) = orders, [[w[i] for i in order] for w, order in zip(self.weights, orders)]
+        n = len(self.suffixes)
+
+        def entry(i, j, k):
+            return -pw[i] * sw[j] * fw[k], offset + po[i] * self.inner + so[j] * n + fo[k], i, j, k
+
+        heap = [entry(0, 0, 0)]
+        while heap:
+            score, index, i, j, k = heapq.heappop(heap)
+            yield score, index, self.prefixes[po[i]] + self.stems[so[j]] + self.suffixes[fo[k]]
+            if k + 1 < len(fw): heapq.heappush(heap, entry(i, j, k + 1))
+            if k == 0 and j + 1 < len(sw): heapq.heappush(heap, entry(i, j + 1, 0))
+            if k == 0 and j == 0 and i + 1 < len(pw): heapq.heappush(heap, entry(i + 1, 0, 0))
+
+    def split(self, path):
+        """
+        分解路径
+        :return: (prefix, stem, suffix) 或 None
+        """
+        if self._stems is None: self._stems = set(self.stems)
+        for prefix in self.prefixes:
+            if not path.startswith(prefix): continue
+            rest = path[len(prefix):]
+            for suffix in self.suffixes:
+                if rest.endswith(suffix) and rest[:len(rest) - len(suffix)] in self._stems:
+                    return prefix, rest[:len(rest) - len(suffix)], suffix
+        return None
+
+
+class Wordlist(object):
+    """
+    由若干 Product 拼接的字典，支持按下标随机访问与流式遍历
+    """
+
+    def __init__(self, products=None):
+        self.products = []
+        self.offsets = []
+        self.size = 0
+        for product in products or []:
+            self.add(product)
+
+    def add(self, product):
+        if not len(product): return
+        self.products.append(product)
+        self.offsets.append(self.size)
+        self.size += len(product)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0: index += self.size
+        if not 0 <= index < self.size: raise IndexError(index)
+        i = bisect.bisect_right(self.offsets, index) - 1
+        return self.products[i][index - self.offsets[i]]
+
+    def __iter__(self):
+        if self.weighted():
+            for score, index, path in self.ranked():
+                yield path
+            return
+        for product in self.products:
+            for path in product:
+                yield path
+
+    def weighted(self):
+        return bool(self.products) and all(product.weights for product in self.products)
+
+    def ranked(self):
+        """
+        各 Product 按权重积合并遍历
+        :return: (-权重积, 下标, 路径) 生成器
+        """
+        return heapq.merge(*[product.ranked(offset) for product, offset in zip(self.products, self.offsets)])
+
+    def split(self, path):
+        """
+        分解路径
+        :return: (prefix, stem, suffix) 或 None
+        """
+        for product in self.products:
+            features = product.split(path)
+            if features is not None: return features
+        return None
+
+    def slice(self, start, stop):
+        """
+        下标区间 [start, stop) 的视图
+        """
+        return WordlistSlice(self, start, stop)
+
+    def shard(self, index, total):
+        """
+        按下标均分为 total 份，取第 index 份
+        """
+        return self.slice(self.size * index // total, self.size * (index + 1) // total)
+
+
+class WordlistSlice(object):
+    """
+    Wordlist 的下标区间视图
+    """
+
+    def __init__(self, wordlist, start, stop):
+        self.wordlist = wordlist
+        self.start = max(0, start)
+        self.stop = min(len(wordlist), stop)
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def __getitem__(self, index):
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError(index)
+        return self.wordlist[self.start + index]
+
+    def __iter__(self):
+        if self.wordlist.weighted():
+            # 按权重顺序遍历整个字典，只取区间内的下标，各分片的划分与权重无关
+            for score, index, path in self.wordlist.ranked():
+                if self.start <= index < self.stop: yield path
+            return
+        for index in xrange(self.start, self.stop):
+            yield self.wordlist[index]
@@ -6,24 +6,129 @@
 # CreateTime: 2018/6/26 : 下午3:24
 
 from config.config import conf
-from core.scanwork import ScanBackup
+from core.scanwork import ScanBackup, shutdown
 from core.command import command
-from core.AnsiColor import Print
+from core.scheduler import Scheduler
+from core.resolver import resolver
+from core.journal import Journal
+from core.ratecontrol import controller
+from core.preflight import preflight
+from core.multiproc import run_sharded
+from core.cluster import run_coordinator, run_worker
+from core.sink import sink
+from core.metrics import metrics
+from core.targets import chunks
+from core.ranking import hit_model
+from core.AnsiColor import Print, Print_W
 
 
-def main():
+def resolve_targets(option):
     """
-    主启动类
-    :return:
+    并行预解析全部目标，丢弃无法解析的目标
+    :param option:
+    :return: 可解析的目标列表
     """
-    option = command()
+    targets = option.get("targets")
+    hosts = [ScanBackup.host_parse(t.get("target").strip())[0] for t in targets]
+    failed = resolver.prefetch(hosts, max(option.get("thread"), 50))
+    if failed:
+        Print_W("域名解析失败，跳过 %d 个目标: %s" % (len(failed), ", ".join(sorted(failed)[:10])))
+    return [t for t, host in zip(targets, hosts) if host not in failed]
+
+
+def preflight_targets(option):
+    """
+    并行检查目标可连接性并校准错误页面，丢弃无法连接的目标
+    :param option:
+    :return: 可扫描的目标列表
+    """
+    failed = preflight(option, conf)
+    if failed:
+        Print_W("目标无法连接，跳过 %d 个目标: %s" % (len(failed), ", ".join(sorted(failed)[:10])))
+    return [t for t in option.get("targets") if t.get("target").strip() not in failed]
+
+
+def scan_targets(option):
+    """
+    扫描目标列表，多进程模式下在各工作进程中运行。调度器在目标初始化时解析与检查目标，
+    逐个扫描时先并行解析、预检整个列表
+    :param option:
+    :return: 是否选择了结束任务
+    """
+    journal = option.get("journal")
+    if option.get("active") > 1:
+        return Scheduler(option, conf).run()
+    option["targets"] = resolve_targets(option)
+    option["targets"] = preflight_targets(option)
     for target_info in option.get("targets"):
+        if shutdown.is_set(): return True
         id = target_info.get("id")
         target = target_info.get("target")
-        scanBackup = ScanBackup(target.strip(), option, conf)
-        Print("TaskID <" + str(id) + "> TaskUrl <" + target.strip() + "> WorkNum <" + str(len(scanBackup.paths)) + ">")
+        if journal and option.get("resume") and journal.target_done(target.strip()): continue
+        scanBackup = ScanBackup(target.strip(), option, conf, target_info.pop("calibrator", None))
+        Print("TaskID <" + str(id) + "> TaskUrl <" + target.strip() + "> WorkNum <" + str(scanBackup.path_num) + ">")
         scanBackup.start()
-        if scanBackup.status: break
+        if scanBackup.status: return True
+    return False
+
+
+def scan_batch(option):
+    """
+    扫描目标列表，分布式模式下每个批次调用一次
+    :param option:
+    :return: 是否选择了结束任务
+    """
+    if option.get("procs") > 1:
+        return run_sharded(option, option.get("procs"), scan_targets)
+    return scan_targets(option)
+
+
+def scan_stream(option):
+    """
+    流式扫描，超大目标文件不必全部载入。调度器直接从目标流中逐个读取目标，
+    慢速目标不会阻塞后续目标；逐个扫描与多进程模式按 -chunk 分组读取
+    :param option:
+    :return:
+    """
+    if option.get("active") > 1 and option.get("procs") <= 1:
+        scheduler = Scheduler(option, conf)
+        scheduler.run()
+        if not scheduler.count: Print_W("没有有效的目标")
+        return
+    count = 0
+    for chunk in chunks(option.get("targets"), option.get("chunk")):
+        count += len(chunk)
+        if scan_batch(dict(option, targets=chunk)): break
+    if not count: Print_W("没有有效的目标")
+
+
+def main():
+    """
+    主启动类
+    :return:
+    """
+    option = command()
+    controller.max_window = option.get("hostcap") or option.get("thread")
+    controller.max_delay = option.get("delay")
+    controller.timeout = option.get("timeout")
+    resolver.ttl = option.get("dnsttl")
+    if option.get("rank"): hit_model.load(conf.get("prior"), conf.get("root") + "/cache/hits.json")
+    journal_path = option.get("journal") or (option.get("resume") and conf.get("root") + "/journal.db")
+    journal = option["journal"] = Journal(journal_path) if journal_path else None
+    sink.start(option.get("output"), option.get("quiet"))
+    metrics.start(option.get("metrics"), option.get("stats"))
+    try:
+        if option.get("serve"):
+            run_coordinator(option, conf)
+        elif option.get("join"):
+            run_worker(option, scan_batch)
+        else:
+            scan_stream(option)
+    finally:
+        metrics.stop()
+        hit_model.save()
+        sink.close()
+        if journal: journal.close()
 
 
 if __name__ == '__main__':